@@ -0,0 +1,195 @@
+"""Throughput benchmark for the send pipeline against the local SMTP sink.
+
+Every scenario runs in a fresh subprocess inside a scratch directory, so its CPU time and peak RSS
+are its own and the real recipients, credentials and logs are never touched. Example:
+
+    python benchmark.py --rows 1000 100000 --engine threads asyncio --latency 5 --output bench.json
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from array import array
+from datetime import datetime
+
+from smtp_sink import SMTPSink
+
+REPO_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+ROW_PRESETS = (1000, 100000, 1000000)
+ENGINES = ('threads', 'asyncio', 'processes', 'spool', 'direct')  # direct calls send_personalized_email in a loop
+UNLIMITED_RATE = 1e9
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def write_store(es, rows):
+    """Writes a synthetic recipient store of rows entries."""
+    with es.RecipientStoreWriter(es.RECIPIENTS_FILE) as writer:
+        for i in range(rows):
+            writer.append({"Row": i + 2, "Last_Name": f"Recipient{i}", "Email": f"user{i}@example.com"})
+
+
+def run_scenario(scenario):
+    """Runs one scenario in this process and returns its measurements."""
+    workdir = tempfile.mkdtemp(prefix="es-bench-")
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIRECTORY)
+    import es
+
+    es.create_default_template()
+
+    es.SMTP_HOST = "127.0.0.1"
+    es.SMTP_PORT = scenario['port']
+    es.SMTP_USE_TLS = False
+    es.ACCOUNT_COOLDOWN = scenario['cooldown']
+    with open(es.CREDENTIALS_FILE, 'w', encoding='utf-8') as f:
+        for n in range(scenario['accounts']):
+            f.write(f"sender{n}@example.com:secret:{scenario['rows'] * 2}\n")
+    write_store(es, scenario['rows'])
+    for account in es.sender_accounts.load():
+        account.limiter.rate = account.limiter.max_rate = UNLIMITED_RATE
+
+    latencies = array('d')
+
+    class LatencyTracker(es.ProgressTracker):
+        """Keeps every per-message elapsed time next to the usual counters."""
+
+        def record(self, success, message, error_class=None, skipped=False, elapsed=None):
+            if elapsed is not None:
+                latencies.append(elapsed)
+            super().record(success, message, error_class, skipped, elapsed)
+
+    es.email_progress = LatencyTracker()
+    es.email_progress.begin()
+
+    self_before = resource.getrusage(resource.RUSAGE_SELF)
+    children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    started = time.perf_counter()
+    if scenario['engine'] == 'direct':
+        account = es.sender_accounts.load()[0]
+        pool = es.SMTPConnectionPool(*account.credentials)
+        compiled = es.get_compiled_template(es.EMAIL_TEMPLATE_FILE)
+        for entry in es.iter_recipients(es.RECIPIENTS_FILE):
+            sent_at = time.perf_counter()
+            success, message = es.send_personalized_email(entry['Email'], entry['Last_Name'], compiled, [], pool,
+                                                          account.limiter, entry)
+            es.email_progress.record(success, message, None if success else 'other',
+                                     elapsed=time.perf_counter() - sent_at)
+        pool.close()
+        es.log_writer.flush()
+        es.email_progress.update(status='completed')
+    else:
+        es.send_emails_thread(scenario['workers'], scenario['engine'], batch=scenario['batch'])
+    elapsed = time.perf_counter() - started
+    self_after = resource.getrusage(resource.RUSAGE_SELF)
+    children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    progress = es.email_progress.snapshot()
+    ordered = sorted(latencies)
+    cpu_user = (self_after.ru_utime - self_before.ru_utime) + (children_after.ru_utime - children_before.ru_utime)
+    cpu_system = (self_after.ru_stime - self_before.ru_stime) + (children_after.ru_stime - children_before.ru_stime)
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss_unit = 1 if sys.platform == 'darwin' else 1024
+    peak_rss = max(self_after.ru_maxrss, children_after.ru_maxrss) * rss_unit
+    if not scenario['keep']:
+        es.log_writer.close()
+        os.chdir(REPO_DIRECTORY)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return dict(scenario, **{
+        'status': progress['status'],
+        'sent': progress['sent'],
+        'failed': progress['failed'],
+        'failures': progress['failures'],
+        'skipped': progress['skipped'],
+        'elapsed_s': round(elapsed, 3),
+        'msgs_per_sec': round((progress['sent'] + progress['failed']) / elapsed, 1) if elapsed else None,
+        'p50_ms': round(percentile(ordered, 0.50) * 1000, 3) if ordered else None,
+        'p99_ms': round(percentile(ordered, 0.99) * 1000, 3) if ordered else None,
+        'cpu_user_s': round(cpu_user, 3),
+        'cpu_system_s': round(cpu_system, 3),
+        'cpu_percent': round(100 * (cpu_user + cpu_system) / elapsed, 1) if elapsed else None,
+        'peak_rss_mb': round(peak_rss / (1024 * 1024), 1),
+        'workdir': workdir if scenario['keep'] else None,
+    })
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIRECTORY, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=list(ROW_PRESETS[:2]),
+                        help=f"Recipient store sizes to generate (presets: {', '.join(map(str, ROW_PRESETS))})")
+    parser.add_argument("--engine", nargs="+", choices=ENGINES, default=['threads', 'asyncio'])
+    parser.add_argument("--workers", type=int, default=8, help="Workers, sessions or threads per shard")
+    parser.add_argument("--accounts", type=int, default=1, help="Sender accounts to rotate through")
+    parser.add_argument("--batch", type=int, default=1,
+                        help="Recipients per transaction; the benchmark template renders identically for everyone")
+    parser.add_argument("--latency", type=float, default=0.0, help="Sink latency per message in milliseconds")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of messages the sink throttles")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of recipients the sink rejects")
+    parser.add_argument("--cooldown", type=float, default=0.0,
+                        help="Seconds a throttled account rests; the app default would stall a throttling run")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--keep", action="store_true", help="Keep each scenario's scratch directory")
+    parser.add_argument("--scenario", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scenario:
+        print(json.dumps(run_scenario(json.loads(args.scenario))))
+        return
+
+    sink = SMTPSink(latency=args.latency / 1000, throttle_rate=args.throttle_rate,
+                    failure_rate=args.failure_rate, seed=args.seed).start()
+    results = []
+    for rows, engine in itertools.product(args.rows, args.engine):
+        scenario = {'rows': rows, 'engine': engine, 'workers': args.workers, 'accounts': args.accounts, 'batch': args.batch,
+                    'latency_ms': args.latency, 'throttle_rate': args.throttle_rate,
+                    'failure_rate': args.failure_rate, 'cooldown': args.cooldown, 'port': sink.port,
+                    'keep': args.keep}
+        print(f"rows={rows} engine={engine} ...", end=" ", file=sys.stderr, flush=True)
+        run = subprocess.run([sys.executable, os.path.abspath(__file__), "--scenario", json.dumps(scenario)],
+                             capture_output=True, text=True)
+        if run.returncode:
+            result = dict(scenario, error=run.stderr.strip().splitlines()[-1] if run.stderr.strip() else "failed")
+            print(result['error'], file=sys.stderr)
+        else:
+            result = json.loads(run.stdout.strip().splitlines()[-1])
+            print(f"{result['msgs_per_sec']} msg/s, p50 {result['p50_ms']} ms, p99 {result['p99_ms']} ms, "
+                  f"cpu {result['cpu_percent']}%, rss {result['peak_rss_mb']} MB", file=sys.stderr)
+        results.append(result)
+    sink.stop()
+
+    report = {
+        'revision': git_revision(),
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {len(results)} results to {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,171 +1,3196 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
+import time
+STARTUP_STARTED = time.perf_counter()  # Taken before the other imports so the cold start figure includes them
+
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, Response, stream_with_context
+from jinja2 import DictLoader
 import getpass, os, sys, re, json
 import smtplib
-import gspread, time, datetime
-from datetime import *
-from oauth2client.service_account import ServiceAccountCredentials
+from datetime import datetime, timedelta
 from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 from email.mime.base import MIMEBase
+from email.generator import Generator
+from email.policy import compat32
 from email import encoders
+import base64, io, random, zlib
+import hashlib, heapq, itertools, mmap, struct, tempfile
 import secrets
 import threading
+import atexit
+import gzip, shutil, sqlite3
+import queue
+import bisect
+from contextlib import contextmanager
+import multiprocessing
+import asyncio, socket, ssl
+from collections import deque
+from array import array
+
+app = Flask(__name__)
+app.secret_key = secrets.token_hex(16)
+
+# Configuration
+EMAIL_TEMPLATE_FILE = "EmailTemplate/template1.txt"
+CREDENTIALS_FILE = "credentials.txt"
+EXTRACTED_DATA_FILE = "extracted_data.json"  # Legacy store, imported once into RECIPIENTS_FILE
+RECIPIENTS_FILE = "recipients.jsonl"
+FILES_DIRECTORY = "Files"
+
+# SMTP settings
+SMTP_HOST = "smtp.gmail.com"
+SMTP_PORT = 587
+SMTP_USE_TLS = True
+SMTP_TIMEOUT = 30
+SMTP_POOL_MAX_MESSAGES = 100  # Recycle a session after this many messages
+SMTP_POOL_MAX_IDLE = 120  # Recycle a session that sat unused this many seconds
+SMTP_POOL_CHECK_IDLE = 10  # Probe a session with NOOP after this many idle seconds
+
+# Scan settings
+NAME_COLUMN = 2  # Adjust this based on your actual column position
+EMAIL_COLUMN = 5  # Adjust this based on your actual column position
+SCAN_PAGE_SIZE = 1000  # Sheet rows fetched per request
+SCAN_VERIFY_PAGE_SIZE = 10000  # Larger pages for incremental scans, where unchanged rows are only hashed
+SCAN_GAP_PROBE_ROWS = 20000  # Rows checked per request for data past a blank page
+SCAN_STATE_FILE = "scan_state.json"
+SUPPRESSION_FILE = "suppression.txt"  # One unsubscribed address per line
+SUPPRESSION_INDEX_FILE = "suppression.idx"  # Sorted 8-byte address hashes, rebuilt when the list changes
+SUPPRESSION_SORT_CHUNK = 1000000  # Hashes sorted in memory at a time while building the index
+DEDUP_BITS_PER_ENTRY = 48  # Bloom filter size; with 7 hashes this gives about one false positive per million
+DEDUP_HASHES = 7
+
+# Send engine settings
+DEFAULT_SEND_WORKERS = 4
+MAX_SEND_WORKERS = 32
+SEND_ENGINES = ('threads', 'asyncio', 'processes', 'spool')  # Threads, one event loop, threads per core, or render ahead to a spool
+DEFAULT_SEND_ENGINE = 'threads'
+MAX_ASYNC_SESSIONS = 500
+SEND_BATCH_SIZE = 1  # Recipients sharing one transaction when their messages render identically; 1 turns batching off
+MAX_SEND_BATCH = 100  # RFC 5321 only obliges servers to take 100 recipients per message
+BATCH_OPEN_GROUPS = 500  # Partly filled batches held back waiting for more identical recipients
+SEND_PROCESSES = os.cpu_count() or 1  # Shards used by the processes engine; workers are threads per shard
+SHARD_BATCH = 256  # A shard sends its outcomes to the web process in batches of this many calls...
+SHARD_FLUSH_INTERVAL = 0.2  # ...or after this many seconds
+SHARD_SETTINGS = ('SMTP_HOST', 'SMTP_PORT', 'SMTP_USE_TLS', 'SMTP_TIMEOUT', 'RECIPIENTS_FILE', 'ACCOUNT_COOLDOWN')
+SPOOL_DIRECTORY = "spool"  # Rendered campaigns waiting for delivery, one directory per campaign
+SPOOL_PUBLISH_EVERY = 256  # The render stage hands messages to delivery in batches of this many...
+SPOOL_PUBLISH_INTERVAL = 0.2  # ...or after this many seconds
+
+# Send log settings
+LOG_FILE = "logs.txt"
+LOG_FLUSH_LINES = 500  # Write the buffered lines once this many are pending...
+LOG_FLUSH_INTERVAL = 1.0  # ...or once the oldest has waited this many seconds
+LOG_INDEX_FILE = "logs.db"  # SQLite index of every log entry, used by the log viewer
+LOG_ARCHIVE_DIRECTORY = "log_archive"
+LOG_ROTATE_BYTES = 5 * 1024 * 1024  # Compress logs.txt into the archive once it grows past this
+LOG_PAGE_SIZE = 100
+
+# Campaign journal settings
+JOURNAL_DIRECTORY = "journals"
+JOURNAL_SYNC_EVERY = 200  # fsync after this many records...
+JOURNAL_SYNC_INTERVAL = 1.0  # ...or after this many seconds, whichever comes first
+
+# Job queue settings
+JOBS_FILE = "jobs.db"  # SQLite queue of scheduled campaigns and their recipients
+JOB_ENGINES = ('threads', 'asyncio')  # Engines that can send a job a batch at a time
+DEFAULT_JOB_ENGINE = 'threads'
+JOB_BATCH = 500  # Recipients sent before the scheduler picks the next job by priority again
+JOB_POLL_INTERVAL = 5  # Longest the scheduler sleeps before checking for newly due jobs
+JOB_PAGE_SIZE = 200
+JOB_ACTIONS = {'pause': ('paused', ('queued', 'running')),  # Action: (new status, statuses it applies to)
+               'resume': ('queued', ('paused',)),
+               'cancel': ('cancelled', ('queued', 'running', 'paused'))}
+
+# Rate limiter settings
+SEND_RATE = 2.0  # Messages per second a campaign starts at
+SEND_RATE_MIN = 0.1
+SEND_RATE_MAX = 20.0
+DAILY_SEND_LIMIT = 2000
+RATE_BACKOFF_FACTOR = 0.5  # Rate multiplier applied on a throttling reply
+RATE_RAMP_FACTOR = 1.2  # Rate multiplier applied after a run of successes
+RATE_RAMP_AFTER = 25  # Consecutive successes needed before ramping up
+THROTTLE_CODES = (421, 450, 454)
+
+# Sender account settings; credentials.txt holds one user:password[:daily_quota[:weight]] line per account
+ACCOUNT_COOLDOWN = 60  # Seconds an account is skipped after being throttled or failing repeatedly
+ACCOUNT_MAX_FAILURES = 3  # Consecutive connection failures before an account cools down
+ACCOUNT_THROUGHPUT_WINDOW = 60  # Seconds of recent sends used for the per-account throughput figure
+ACCOUNT_RETRY_ERRORS = ('auth', 'throttled', 'daily_limit')  # Account-level failures retried on another account
+SEND_COUNT_FILE = "send_counts.json"  # Today's sends per account, so daily quotas survive a restart
+SEND_COUNT_SAVE_INTERVAL = 2  # Seconds between saves of the send counts while a campaign runs
+
+# Instrumentation settings
+METRIC_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)  # Seconds
+PROFILE_DIRECTORY = "profiles"
+PROFILE_INTERVAL = 0.005  # Seconds between stack samples while a campaign is profiled
+
+# Template placeholders: {{Column}} anywhere, plus the legacy "name" token on the second line
+PLACEHOLDER_PATTERN = re.compile(r"\{\{\s*(\w+)\s*\}\}")
+NAME_TOKEN = "name"
+NAME_FIELD = "Last_Name"
+
+# Message serialization: the policy Message.as_string() uses, and the EOL fixing sendmail() applies
+MESSAGE_POLICY = compat32.clone(max_line_length=0)
+LINE_END_PATTERN = re.compile(r'(?:\r\n|\n|\r(?!\n))')
+
+PROGRESS_RECENT_EVENTS = 200  # Size of the ring buffer of recent results
+PROGRESS_STREAM_INTERVAL = 0.25  # Minimum seconds between two pushed progress events
+PROGRESS_STREAM_HEARTBEAT = 15  # Seconds of silence before a keep-alive comment is sent
+
+class ProgressEvent:
+    """One recipient outcome in the recent-events ring buffer."""
+
+    __slots__ = ('seq', 'success', 'message', 'elapsed')
+
+    def __init__(self, seq, success, message, elapsed=None):
+        self.seq = seq
+        self.success = success
+        self.message = message
+        self.elapsed = elapsed
+
+class ProgressTracker:
+    """Thread-safe campaign progress: aggregate counters plus a fixed-size ring buffer of recent events."""
+
+    def __init__(self, recent=PROGRESS_RECENT_EVENTS):
+        self.changed = threading.Condition(threading.Lock())
+        self.status = 'idle'
+        self.version = 0
+        self._recent = deque(maxlen=recent)
+        self._next_seq = 0
+        self._first_seq = 0
+        self._reset()
+
+    def _reset(self):
+        self.total = 0
+        self.sent = 0
+        self.failed = 0
+        self.skipped = 0
+        self.resumed = 0
+        self.failures = {}
+        self.workers = 0
+        self.engine = DEFAULT_SEND_ENGINE
+        self.profile = None
+
+    def _changed(self):
+        self.version += 1
+        self.changed.notify_all()
+
+    @property
+    def running(self):
+        return self.status in ('starting', 'sending')
+
+    def begin(self):
+        """Claims the tracker for a new campaign; returns False if one is already running."""
+        with self.changed:
+            if self.running:
+                return False
+            self._reset()
+            self.status = 'starting'
+            # Events of the previous campaign are dropped; sequence numbers keep counting so cursors stay valid
+            self._recent.clear()
+            self._first_seq = self._next_seq
+            self._changed()
+            return True
+
+    def update(self, **fields):
+        with self.changed:
+            for name, value in fields.items():
+                setattr(self, name, value)
+            self._changed()
+
+    def record(self, success, message, error_class=None, skipped=False, elapsed=None):
+        """Counts one recipient's outcome, taking elapsed seconds, and keeps it in the ring buffer."""
+        with self.changed:
+            if success:
+                self.sent += 1
+            elif skipped:
+                self.skipped += 1
+            else:
+                self.failed += 1
+                self.failures[error_class or 'other'] = self.failures.get(error_class or 'other', 0) + 1
+            self._recent.append(ProgressEvent(self._next_seq, success, message, elapsed))
+            self._next_seq += 1
+            self._changed()
+
+    def resume(self, count=1):
+        """Counts recipients an earlier run of the campaign already delivered."""
+        with self.changed:
+            self.skipped += count
+            self.resumed += count
+            self._changed()
+
+    def fail(self, message):
+        """Marks the campaign as failed before any recipient was sent."""
+        with self.changed:
+            self.status = 'error'
+            self._recent.append(ProgressEvent(self._next_seq, False, message))
+            self._next_seq += 1
+            self._changed()
+
+    def wait(self, version, timeout):
+        """Blocks until the progress changed since version, or timeout elapses."""
+        with self.changed:
+            self.changed.wait_for(lambda: self.version != version, timeout=timeout)
+
+    def snapshot(self, cursor=0):
+        """Returns the counters plus the recent events recorded at or after cursor."""
+        with self.changed:
+            oldest = self._recent[0].seq if self._recent else self._next_seq
+            if cursor > self._next_seq:
+                cursor = oldest
+            cursor = max(cursor, self._first_seq)
+            progress = {
+                'status': self.status,
+                'total': self.total,
+                'current': self.sent + self.failed + self.skipped,
+                'sent': self.sent,
+                'failed': self.failed,
+                'failures': dict(self.failures),
+                'skipped': self.skipped,
+                'resumed': self.resumed,
+                'workers': self.workers,
+                'engine': self.engine,
+                'profile': self.profile,
+                'results': [{'success': event.success, 'message': event.message, 'elapsed': event.elapsed}
+                            for event in self._recent if event.seq >= cursor],
+                'missed': max(0, oldest - cursor),
+                'cursor': self._next_seq,
+                'version': self.version,
+            }
+        progress.update(sender_accounts.status())
+        return progress
+
+# Global variable to track email sending progress
+email_progress = ProgressTracker()
+
+class StageHistogram:
+    """Cumulative-ready bucket counts, sum and count of one stage's durations."""
+
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(METRIC_BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+class Metrics:
+    """Per-stage timing histograms of the send and scan paths, plus the live gauges shown on /metrics."""
+
+    def __init__(self):
+        self.sessions = 0
+        self.queue = None
+        self._stages = {}
+        self._remote = {}  # Gauges reported by shard processes, by shard
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        bucket = bisect.bisect_left(METRIC_BUCKETS, seconds)
+        with self._lock:
+            histogram = self._stages.get(stage)
+            if histogram is None:
+                histogram = self._stages[stage] = StageHistogram()
+            histogram.counts[bucket] += 1
+            histogram.sum += seconds
+            histogram.count += 1
+
+    @contextmanager
+    def time(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def adjust_sessions(self, delta):
+        with self._lock:
+            self.sessions += delta
+
+    def queue_depth(self):
+        depth = self.queue.qsize() if self.queue is not None else 0
+        # merge and forget change the shards from the campaign thread while a scrape reads them
+        with self._lock:
+            return depth + sum(gauges['queue'] for gauges in self._remote.values())
+
+    def active_sessions(self):
+        with self._lock:
+            return self.sessions + sum(gauges['sessions'] for gauges in self._remote.values())
+
+    def drain(self):
+        """Returns and resets the histograms, with the current gauges, for shipping to another process."""
+        with self._lock:
+            stages, self._stages = self._stages, {}
+        return {'stages': {stage: (h.counts, h.sum, h.count) for stage, h in stages.items()},
+                'sessions': self.sessions, 'queue': self.queue.qsize() if self.queue is not None else 0}
+
+    def merge(self, source, data):
+        """Adds histograms drained in a shard process and takes over its gauges."""
+        with self._lock:
+            for stage, (counts, total, count) in data['stages'].items():
+                histogram = self._stages.get(stage)
+                if histogram is None:
+                    histogram = self._stages[stage] = StageHistogram()
+                histogram.counts = [a + b for a, b in zip(histogram.counts, counts)]
+                histogram.sum += total
+                histogram.count += count
+            self._remote[source] = {'sessions': data['sessions'], 'queue': data['queue']}
+
+    def forget(self, source):
+        with self._lock:
+            self._remote.pop(source, None)
+
+    def render_histograms(self):
+        """Returns the histograms in the Prometheus text format."""
+        lines = ["# HELP es_stage_seconds Time spent in each stage of the send and scan paths.",
+                 "# TYPE es_stage_seconds histogram"]
+        with self._lock:
+            stages = sorted((stage, list(h.counts), h.sum, h.count) for stage, h in self._stages.items())
+        for stage, counts, total, count in stages:
+            cumulative = 0
+            for bound, bucket_count in zip(METRIC_BUCKETS + ('+Inf',), counts):
+                cumulative += bucket_count
+                lines.append(f'es_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'es_stage_seconds_sum{{stage="{stage}"}} {total:.6f}')
+            lines.append(f'es_stage_seconds_count{{stage="{stage}"}} {count}')
+        return lines
+
+metrics = Metrics()
+
+class SamplingProfiler:
+    """Samples every thread's stack every PROFILE_INTERVAL seconds into collapsed-stack counts (flame graph input).
+
+    Only this process is sampled, so with the processes engine it shows the coordinating side.
+    """
+
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self.samples = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                key = ";".join(reversed(stack))
+                self.samples[key] = self.samples.get(key, 0) + 1
+
+    def stop(self, path):
+        """Stops sampling and writes one "stack count" line per distinct stack to path."""
+        self._stop.set()
+        self._thread.join()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in sorted(self.samples.items(), key=lambda item: -item[1]):
+                f.write(f"{stack} {count}\n")
+        return path
+
+# Global variable to track Google Sheets scan progress
+scan_progress = {
+    'current': 0,
+    'total': 0,
+    'status': 'idle',
+    'message': ''
+}
+
+def recipient_header_path(path=RECIPIENTS_FILE):
+    """Returns the sidecar header path for a recipient store."""
+    return os.path.splitext(path)[0] + ".meta.json"
+
+def read_recipient_header(path=RECIPIENTS_FILE):
+    """Reads the row count and checksum of a recipient store without touching its rows."""
+    try:
+        with open(recipient_header_path(path), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def iter_recipient_lines(path=RECIPIENTS_FILE):
+    """Yields the undecoded JSON line of each recipient entry in a JSON Lines store."""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield line
+
+def iter_recipients(path=RECIPIENTS_FILE):
+    """Yields recipient entries one at a time from a JSON Lines store."""
+    for line in iter_recipient_lines(path):
+        yield json.loads(line)
+
+class RecipientStoreWriter:
+    """Writes a JSON Lines recipient store and its sidecar header (row count and CRC32 checksum)."""
+
+    def __init__(self, path=RECIPIENTS_FILE, append=False):
+        self.path = path
+        self.rows = 0
+        self.checksum = 0
+        header = read_recipient_header(path) if append and os.path.exists(path) else None
+        if header:
+            self.rows = header['rows']
+            self.checksum = int(header['checksum'], 16)
+            self._target = path
+            self._file = open(path, 'ab')
+        else:
+            # A full rewrite goes to a temp file so readers never see a half-written store
+            self._target = path + ".tmp"
+            self._file = open(self._target, 'wb')
+
+    def append(self, entry):
+        line = (json.dumps(entry, ensure_ascii=False) + "\n").encode('utf-8')
+        self._file.write(line)
+        self.checksum = zlib.crc32(line, self.checksum)
+        self.rows += 1
+
+    def commit(self):
+        """Flushes the rows, moves the store into place and writes its header."""
+        with metrics.time('store_commit'):
+            self._commit()
+
+    def _commit(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        if self._target != self.path:
+            os.replace(self._target, self.path)
+        header_path = recipient_header_path(self.path)
+        with open(header_path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump({'rows': self.rows, 'checksum': '%08x' % self.checksum,
+                       'updated': datetime.now().isoformat(timespec='seconds')}, f)
+        os.replace(header_path + ".tmp", header_path)
+
+    def abort(self):
+        self._file.close()
+        if self._target != self.path:
+            os.remove(self._target)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+
+def import_extracted_data(json_path=EXTRACTED_DATA_FILE, store_path=RECIPIENTS_FILE):
+    """One-shot import of a legacy extracted_data.json array into the JSON Lines store."""
+    try:
+        with open(json_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        with RecipientStoreWriter(store_path) as writer:
+            for entry in data:
+                if 'Email' in entry:
+                    writer.append(entry)
+        return True, f"Imported {writer.rows} entries from {json_path}."
+    except Exception as e:
+        return False, f"Error importing {json_path}: {e}"
+
+def count_emails(file_path=RECIPIENTS_FILE):
+    """Returns the number of recipients in a store, read from its header."""
+    header = read_recipient_header(file_path)
+    return header['rows'] if header else 0
+
+def get_current_user():
+    """Get the current logged-in user, noting how many other sender accounts there are."""
+    accounts = load_accounts()
+    if not accounts:
+        return None
+    if len(accounts) > 1:
+        return f"{accounts[0][0]} (+{len(accounts) - 1} more)"
+    return accounts[0][0]
+
+def parse_account_line(line):
+    """Parses a user:password[:daily_quota[:weight]] line; returns None for blank or malformed lines."""
+    parts = line.strip().split(":")
+    if len(parts) < 2 or len(parts) > 4 or not parts[0] or not parts[1]:
+        return None
+    try:
+        quota = int(parts[2]) if len(parts) > 2 and parts[2] else DAILY_SEND_LIMIT
+        weight = int(parts[3]) if len(parts) > 3 and parts[3] else 1
+    except ValueError:
+        return None
+    return parts[0], parts[1], max(0, quota), max(1, weight)
+
+def load_accounts(filename=CREDENTIALS_FILE):
+    """Loads every sender account as (username, password, daily_quota, weight)."""
+    try:
+        with open(filename, "r", encoding='utf-8') as file:
+            return [account for account in map(parse_account_line, file) if account]
+    except (FileNotFoundError, IOError):
+        return []
+
+def save_accounts(accounts, filename=CREDENTIALS_FILE):
+    """Writes the account list back, omitting quota and weight when they are the defaults."""
+    with open(filename, "w", encoding='utf-8') as file:
+        for username, password, quota, weight in accounts:
+            line = f"{username}:{password}"
+            if quota != DAILY_SEND_LIMIT or weight != 1:
+                line += f":{quota}"
+            if weight != 1:
+                line += f":{weight}"
+            file.write(line + "\n")
+
+def load_credentials(filename=CREDENTIALS_FILE):
+    """Loads the username and password of the first account."""
+    accounts = load_accounts(filename)
+    if not accounts:
+        return None
+    return accounts[0][:2]
+
+def open_smtp_session(username, password, host=None, port=None):
+    """Opens an SMTP connection, runs STARTTLS and logs in."""
+    with metrics.time('connect'):
+        server = smtplib.SMTP(host or SMTP_HOST, port or SMTP_PORT, timeout=SMTP_TIMEOUT)
+    try:
+        if SMTP_USE_TLS:
+            with metrics.time('starttls'):
+                server.starttls()
+        with metrics.time('auth'):
+            server.login(username, password)
+    except Exception:
+        server.close()
+        raise
+    return server
+
+def abort_transaction(server, code=None):
+    """Resets a failed transaction the way smtplib does, dropping the connection on a 421 reply."""
+    if code == 421:
+        server.close()
+        return
+    try:
+        server.rset()
+    except smtplib.SMTPServerDisconnected:
+        pass
+
+def pipelined_sendmail(server, sender, receivers, message):
+    """smtplib's sendmail, but MAIL FROM and every RCPT TO go out in one write when the server advertises PIPELINING."""
+    if isinstance(receivers, str):
+        receivers = [receivers]
+    server.ehlo_or_helo_if_needed()
+    if not server.has_extn('pipelining'):
+        return server.sendmail(sender, receivers, message)
+    size = f" SIZE={len(message)}" if server.has_extn('size') else ""
+    server.send(f"MAIL FROM:{smtplib.quoteaddr(sender)}{size}\r\n"
+                + "".join(f"RCPT TO:{smtplib.quoteaddr(receiver)}\r\n" for receiver in receivers))
+    # Every pipelined command gets a reply, even after MAIL FROM was refused
+    replies = [server.getreply() for _ in range(len(receivers) + 1)]
+    code, text = replies[0]
+    if code != 250:
+        abort_transaction(server, code)
+        raise smtplib.SMTPSenderRefused(code, text, sender)
+    refused = {receiver: reply for receiver, reply in zip(receivers, replies[1:]) if reply[0] not in (250, 251)}
+    if len(refused) == len(receivers):
+        abort_transaction(server)
+        raise smtplib.SMTPRecipientsRefused(refused)
+    code, text = server.data(message)
+    if code != 250:
+        abort_transaction(server, code)
+        raise smtplib.SMTPDataError(code, text)
+    return refused
+
+class SMTPSession:
+    """An authenticated SMTP connection handed out by SMTPConnectionPool."""
+
+    def __init__(self, server):
+        self.server = server
+        self.created = time.monotonic()
+        self.last_used = self.created
+        self.messages = 0
+        metrics.adjust_sessions(1)
+
+    def close(self):
+        metrics.adjust_sessions(-1)
+        try:
+            self.server.quit()
+        except Exception:
+            self.server.close()
+
+class SMTPConnectionPool:
+    """Keeps authenticated SMTP sessions open across recipients."""
+
+    def __init__(self, username, password, size=1, host=None, port=None,
+                 max_messages=SMTP_POOL_MAX_MESSAGES, max_idle=SMTP_POOL_MAX_IDLE):
+        self.username = username
+        self.password = password
+        self.size = max(1, size)
+        self.host = host
+        self.port = port
+        self.max_messages = max_messages
+        self.max_idle = max_idle
+        self._idle = []
+        self._open = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def _connect(self):
+        return SMTPSession(open_smtp_session(self.username, self.password, self.host, self.port))
+
+    def _is_usable(self, session):
+        """Checks whether an idle session can be reused, probing it with NOOP if needed."""
+        now = time.monotonic()
+        if session.messages >= self.max_messages or now - session.last_used > self.max_idle:
+            return False
+        if now - session.last_used > SMTP_POOL_CHECK_IDLE:
+            try:
+                return session.server.noop()[0] == 250
+            except Exception:
+                return False
+        return True
+
+    def acquire(self):
+        """Borrows a live session, reconnecting when the idle one is stale or dead."""
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise RuntimeError("SMTP connection pool is closed.")
+                if self._idle:
+                    session = self._idle.pop()
+                    break
+                if self._open < self.size:
+                    self._open += 1
+                    session = None
+                    break
+                self._cond.wait()
+        if session is not None:
+            if self._is_usable(session):
+                return session
+            session.close()
+        try:
+            return self._connect()
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, session, discard=False):
+        """Returns a session to the pool, or closes it if it is broken or worn out."""
+        if not discard and session.messages >= self.max_messages:
+            discard = True
+        if discard:
+            session.close()
+        with self._cond:
+            if discard:
+                self._open -= 1
+            elif self._closed:
+                session.close()
+                self._open -= 1
+            else:
+                self._idle.append(session)
+            self._cond.notify()
+
+    def sendmail(self, sender, receivers, message):
+        """Sends one message over a pooled session, reconnecting once if the session died."""
+        for attempt in range(2):
+            session = self.acquire()
+            try:
+                with metrics.time('data'):
+                    refused = pipelined_sendmail(session.server, sender, receivers, message)
+            except smtplib.SMTPServerDisconnected:
+                self.release(session, discard=True)
+                if attempt:
+                    raise
+                continue
+            except smtplib.SMTPResponseException:
+                self.release(session, discard=not self._reset(session))
+                raise
+            except smtplib.SMTPRecipientsRefused:
+                self.release(session)
+                raise
+            except Exception:
+                self.release(session, discard=True)
+                raise
+            session.messages += 1
+            session.last_used = time.monotonic()
+            self.release(session)
+            return refused
+
+    def _reset(self, session):
+        try:
+            return session.server.rset()[0] == 250
+        except Exception:
+            return False
+
+    def close(self):
+        """Closes every idle session; sessions still borrowed are closed on release."""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+            self._cond.notify_all()
+        for session in idle:
+            session.close()
+
+class AccountPools(dict):
+    """One SMTPConnectionPool per account username, opened on first use so accounts added mid-campaign get one too."""
+
+    def __init__(self, size):
+        super().__init__()
+        self.size = size
+        self._lock = threading.Lock()
+
+    def __missing__(self, username):
+        with self._lock:
+            if username not in self:
+                account = sender_accounts.get(username)
+                if account is None:
+                    raise KeyError(username)
+                self[username] = SMTPConnectionPool(*account.credentials, size=self.size)
+            return dict.__getitem__(self, username)
+
+    def close(self):
+        for pool in list(self.values()):
+            pool.close()
+
+_local_hostname = None
+
+def local_hostname():
+    """Returns the name sent in EHLO, looked up once since getfqdn can block on DNS."""
+    global _local_hostname
+    if _local_hostname is None:
+        _local_hostname = socket.getfqdn()
+    return _local_hostname
+
+def quote_data(message):
+    """Dot-stuffs and terminates message bytes for the DATA command, as smtplib does."""
+    data = re.sub(br'(?m)^\.', b'..', message)
+    if not data.endswith(b'\r\n'):
+        data += b'\r\n'
+    return data + b'.\r\n'
+
+class AsyncSMTPSession:
+    """A minimal asyncio SMTP client: EHLO, STARTTLS, AUTH PLAIN/LOGIN and one mail transaction at a time, pipelined if offered."""
+
+    def __init__(self, host=None, port=None, timeout=SMTP_TIMEOUT):
+        self.host = host or SMTP_HOST
+        self.port = port or SMTP_PORT
+        self.timeout = timeout
+        self.features = {}
+        self.messages = 0
+        self.connected = False
+        self._reader = None
+        self._writer = None
+
+    async def _reply(self):
+        """Reads one possibly multi-line reply and returns (code, text)."""
+        lines = []
+        while True:
+            line = await asyncio.wait_for(self._reader.readline(), self.timeout)
+            if not line:
+                raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+            lines.append(line[4:].strip())
+            if line[3:4] != b'-':
+                break
+        try:
+            code = int(line[:3])
+        except ValueError:
+            code = -1
+        return code, b"\n".join(lines)
+
+    async def command(self, line):
+        self._writer.write(line.encode('utf-8') + b"\r\n")
+        await asyncio.wait_for(self._writer.drain(), self.timeout)
+        return await self._reply()
+
+    async def _ehlo(self):
+        code, text = await self.command(f"EHLO {local_hostname()}")
+        if code != 250:
+            raise smtplib.SMTPHeloError(code, text)
+        self.features = {}
+        for line in text.decode('latin-1').split('\n')[1:]:
+            parts = line.split(None, 1)
+            if parts:
+                self.features[parts[0].lower()] = parts[1] if len(parts) > 1 else ''
+
+    async def connect(self, username, password, use_tls=None):
+        """Opens the connection, runs STARTTLS if configured and logs in."""
+        with metrics.time('connect'):
+            self._reader, self._writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port),
+                                                                self.timeout)
+            code, text = await self._reply()
+            if code != 220:
+                raise smtplib.SMTPConnectError(code, text)
+            await self._ehlo()
+        if SMTP_USE_TLS if use_tls is None else use_tls:
+            with metrics.time('starttls'):
+                if 'starttls' not in self.features:
+                    raise smtplib.SMTPNotSupportedError("STARTTLS extension not supported by server.")
+                code, text = await self.command("STARTTLS")
+                if code != 220:
+                    raise smtplib.SMTPResponseException(code, text)
+                await asyncio.wait_for(self._writer.start_tls(ssl.create_default_context(), server_hostname=self.host),
+                                       self.timeout)
+                await self._ehlo()
+        with metrics.time('auth'):
+            await self._login(username, password)
+        self.connected = True
+        metrics.adjust_sessions(1)
+
+    async def _login(self, username, password):
+        methods = self.features.get('auth', '').upper().split()
+        if 'PLAIN' in methods:
+            token = base64.b64encode(f"\0{username}\0{password}".encode('utf-8')).decode('ascii')
+            code, text = await self.command(f"AUTH PLAIN {token}")
+        elif 'LOGIN' in methods:
+            code, text = await self.command("AUTH LOGIN")
+            for value in (username, password):
+                if code != 334:
+                    break
+                code, text = await self.command(base64.b64encode(value.encode('utf-8')).decode('ascii'))
+        else:
+            raise smtplib.SMTPNotSupportedError("No suitable authentication method found.")
+        if code not in (235, 503):
+            raise smtplib.SMTPAuthenticationError(code, text)
+
+    async def sendmail(self, sender, receivers, message):
+        """Runs one MAIL/RCPT/DATA transaction; like smtplib, returns the refused recipients or raises if all were refused."""
+        with metrics.time('data'):
+            return await self._transaction(sender, receivers, message)
+
+    async def _transaction(self, sender, receivers, message):
+        if isinstance(receivers, str):
+            receivers = [receivers]
+        lines = [f"MAIL FROM:<{sender}>"] + [f"RCPT TO:<{receiver}>" for receiver in receivers]
+        if 'pipelining' in self.features:
+            self._writer.write(b"".join(line.encode('utf-8') + b"\r\n" for line in lines))
+            await asyncio.wait_for(self._writer.drain(), self.timeout)
+            replies = [await self._reply() for _ in lines]
+        else:
+            replies = [await self.command(lines[0])]
+            if replies[0][0] == 250:
+                replies += [await self.command(line) for line in lines[1:]]
+        code, text = replies[0]
+        if code != 250:
+            raise smtplib.SMTPSenderRefused(code, text, sender)
+        refused = {receiver: reply for receiver, reply in zip(receivers, replies[1:]) if reply[0] not in (250, 251)}
+        if len(refused) == len(receivers):
+            raise smtplib.SMTPRecipientsRefused(refused)
+        code, text = await self.command("DATA")
+        if code != 354:
+            raise smtplib.SMTPDataError(code, text)
+        self._writer.write(quote_data(message))
+        await asyncio.wait_for(self._writer.drain(), self.timeout)
+        code, text = await self._reply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, text)
+        self.messages += 1
+        return refused
+
+    async def rset(self):
+        try:
+            return (await self.command("RSET"))[0] == 250
+        except Exception:
+            return False
+
+    async def close(self, quit=True):
+        if self._writer is None:
+            return
+        if self.connected:
+            self.connected = False
+            metrics.adjust_sessions(-1)
+        if quit:
+            try:
+                await self.command("QUIT")
+            except Exception:
+                pass
+        self._writer.close()
+        self._writer = None
+
+class AsyncSMTPSender:
+    """One asyncio worker's session: connects lazily, recycles worn-out sessions and reconnects once on disconnect."""
+
+    def __init__(self, username, password, host=None, port=None, max_messages=SMTP_POOL_MAX_MESSAGES):
+        self.username = username
+        self.password = password
+        self.host = host
+        self.port = port
+        self.max_messages = max_messages
+        self.session = None
+
+    async def _session(self):
+        if self.session is not None and self.session.messages >= self.max_messages:
+            await self.close()
+        if self.session is None:
+            session = AsyncSMTPSession(self.host, self.port)
+            try:
+                await session.connect(self.username, self.password)
+            except BaseException:
+                await session.close(quit=False)
+                raise
+            self.session = session
+        return self.session
+
+    async def _discard(self):
+        session, self.session = self.session, None
+        if session is not None:
+            await session.close(quit=False)
+
+    async def sendmail(self, sender, receivers, message):
+        """Sends one message, mirroring SMTPConnectionPool.sendmail."""
+        for attempt in range(2):
+            session = await self._session()
+            try:
+                return await session.sendmail(sender, receivers, message)
+            except smtplib.SMTPServerDisconnected:
+                await self._discard()
+                if attempt:
+                    raise
+            except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused):
+                if not await session.rset():
+                    await self._discard()
+                raise
+            except BaseException:
+                await self._discard()
+                raise
+
+    async def close(self):
+        session, self.session = self.session, None
+        if session is not None:
+            await session.close()
+
+class RateLimiter:
+    """Token bucket shared by all send workers, with a daily budget and adaptive rate."""
+
+    def __init__(self, rate=SEND_RATE, min_rate=SEND_RATE_MIN, max_rate=SEND_RATE_MAX,
+                 daily_limit=DAILY_SEND_LIMIT):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.daily_limit = daily_limit
+        self._tokens = 1.0
+        self._updated = time.monotonic()
+        self._streak = 0
+        self._day = datetime.now().date()
+        self._sent_today = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(max(1.0, self.rate), self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _roll_day(self):
+        today = datetime.now().date()
+        if today != self._day:
+            self._day = today
+            self._sent_today = 0
+
+    def _take(self):
+        """Takes a token if one is available; returns 0, the seconds to wait, or None once the daily budget is spent."""
+        with self._lock:
+            self._roll_day()
+            if self._sent_today >= self.daily_limit:
+                return None
+            self._refill(time.monotonic())
+            if self._tokens >= 1:
+                self._tokens -= 1
+                self._sent_today += 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        """Blocks until a send is allowed; returns False once the daily budget is spent."""
+        while True:
+            wait = self._take()
+            if wait is None:
+                return False
+            if not wait:
+                return True
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        """Like acquire, but waits without blocking the event loop."""
+        while True:
+            wait = self._take()
+            if wait is None:
+                return False
+            if not wait:
+                return True
+            await asyncio.sleep(wait)
+
+    def record(self, success, code=None):
+        """Adjusts the rate from a send outcome: back off on throttling, ramp up on a run of successes."""
+        with self._lock:
+            if code in THROTTLE_CODES:
+                self.rate = max(self.min_rate, self.rate * RATE_BACKOFF_FACTOR)
+                self._tokens = min(self._tokens, 0.0)
+                self._streak = 0
+            elif success:
+                self._streak += 1
+                if self._streak >= RATE_RAMP_AFTER:
+                    self.rate = min(self.max_rate, self.rate * RATE_RAMP_FACTOR)
+                    self._streak = 0
+
+    def sent_today(self):
+        with self._lock:
+            self._roll_day()
+            return self._sent_today
+
+    def share(self, shard, shards):
+        """Returns RateLimiter arguments for one of shards processes, splitting the rate and what is left of today's budget."""
+        remaining = self.remaining_today()
+        return {'rate': self.rate / shards, 'min_rate': self.min_rate / shards, 'max_rate': self.max_rate / shards,
+                'daily_limit': remaining // shards + (shard < remaining % shards)}
+
+    def charge(self, count):
+        """Counts sends made elsewhere, such as in shard processes, against today's budget."""
+        with self._lock:
+            self._roll_day()
+            self._sent_today += count
+
+    def remaining_today(self):
+        with self._lock:
+            self._roll_day()
+            return max(0, self.daily_limit - self._sent_today)
+
+    def status(self):
+        """Returns the current rate and remaining daily quota for progress reporting."""
+        return {'rate': round(self.rate, 2), 'daily_remaining': self.remaining_today()}
+
+class SenderAccount:
+    """One sender account with its own rate limiter, health state and send counters."""
+
+    def __init__(self, username, password, daily_limit=DAILY_SEND_LIMIT, weight=1, limiter=None):
+        self.username = username
+        self.password = password
+        self.weight = weight
+        self.limiter = limiter or RateLimiter(daily_limit=daily_limit)
+        self.current_weight = 0
+        self.sent = 0
+        self.failed = 0
+        self.failures_in_row = 0
+        self.cooldown_until = 0.0
+        self.auth_failed = False
+        self.recent = deque()
+
+    @property
+    def credentials(self):
+        return self.username, self.password
+
+    @property
+    def usable(self):
+        return not self.auth_failed and self.limiter.remaining_today() > 0
+
+    def health(self):
+        if self.auth_failed:
+            return 'auth failed'
+        if self.limiter.remaining_today() <= 0:
+            return 'quota used'
+        if self.cooldown_until > time.monotonic():
+            return 'cooling down'
+        return 'ok'
+
+class SenderAccounts:
+    """Every sender account, picked by smooth weighted round-robin among the healthy ones.
+
+    Accounts keep their limiter and counters across campaigns, so reloading credentials.txt
+    only adds, updates or drops the accounts that changed. Today's send counts are saved to
+    counts_path, and an account loaded after a restart starts from what it already sent today.
+    """
+
+    def __init__(self, path=CREDENTIALS_FILE, counts_path=SEND_COUNT_FILE):
+        self.path = path
+        self.counts_path = counts_path
+        self._accounts = {}
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._saved_at = 0.0
+
+    def accounts(self):
+        with self._lock:
+            return list(self._accounts.values())
+
+    def load(self):
+        """Syncs with the credentials file and returns the accounts in file order."""
+        if self.path is None:
+            return self.accounts()
+        loaded = load_accounts(self.path)
+        saved = self.saved_counts()
+        with self._lock:
+            accounts = {}
+            for username, password, quota, weight in loaded:
+                account = self._accounts.get(username)
+                if account is None:
+                    account = SenderAccount(username, password, quota, weight)
+                    account.limiter.charge(saved.get(username, 0))
+                elif account.password != password:
+                    account.password = password
+                    account.auth_failed = False
+                account.weight = weight
+                account.limiter.daily_limit = quota
+                accounts[username] = account
+            self._accounts = accounts
+            return list(accounts.values())
+
+    def add(self, account):
+        with self._lock:
+            self._accounts[account.username] = account
+
+    def saved_counts(self):
+        """Returns the send counts saved today, by username."""
+        if self.counts_path is None:
+            return {}
+        try:
+            with open(self.counts_path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if saved.get('date') != datetime.now().date().isoformat():
+            return {}
+        return saved.get('counts', {})
+
+    def save_counts(self, force=False):
+        """Saves today's send count of every account, at most every SEND_COUNT_SAVE_INTERVAL seconds unless forced."""
+        if self.counts_path is None or not self._save_lock.acquire(blocking=force):
+            return
+        try:
+            if not force and time.monotonic() - self._saved_at < SEND_COUNT_SAVE_INTERVAL:
+                return
+            self._saved_at = time.monotonic()
+            counts = self.saved_counts()
+            counts.update((account.username, account.limiter.sent_today()) for account in self.accounts())
+            with open(self.counts_path + ".tmp", 'w', encoding='utf-8') as f:
+                json.dump({'date': datetime.now().date().isoformat(), 'counts': counts}, f)
+            os.replace(self.counts_path + ".tmp", self.counts_path)
+        except OSError as e:
+            print(f"Could not save send counts: {e}")
+        finally:
+            self._save_lock.release()
+
+    def get(self, username):
+        with self._lock:
+            return self._accounts.get(username)
+
+    def reset_health(self):
+        """Gives every account a fresh start, as a new campaign might follow a password change."""
+        with self._lock:
+            for account in self._accounts.values():
+                account.auth_failed = False
+                account.failures_in_row = 0
+                account.cooldown_until = 0.0
+
+    def choose(self, exclude=()):
+        """Returns (account, 0) for the next usable account, or (None, seconds until one cools down), or (None, None)."""
+        with self._lock:
+            now = time.monotonic()
+            candidates = [account for account in self._accounts.values() if account not in exclude and account.usable]
+            ready = [account for account in candidates if account.cooldown_until <= now]
+            if not ready:
+                return None, min((account.cooldown_until - now for account in candidates), default=None)
+            total = 0
+            best = None
+            for account in ready:
+                account.current_weight += account.weight
+                total += account.weight
+                if best is None or account.current_weight > best.current_weight:
+                    best = account
+            best.current_weight -= total
+            return best, 0
+
+    def record(self, account, error_class):
+        """Updates an account's health from one send outcome."""
+        with self._lock:
+            if error_class is None:
+                account.failures_in_row = 0
+            elif error_class == 'auth':
+                account.auth_failed = True
+            elif error_class == 'throttled':
+                account.cooldown_until = time.monotonic() + ACCOUNT_COOLDOWN
+            elif error_class == 'connection':
+                account.failures_in_row += 1
+                if account.failures_in_row >= ACCOUNT_MAX_FAILURES:
+                    account.failures_in_row = 0
+                    account.cooldown_until = time.monotonic() + ACCOUNT_COOLDOWN
+        self.count(account.username, error_class)
+
+    def count(self, username, error_class):
+        """Adds one outcome to an account's counters."""
+        with self._lock:
+            account = self._accounts.get(username)
+            if account is None:
+                return
+            if error_class is None:
+                account.sent += 1
+                now = time.monotonic()
+                account.recent.append(now)
+                while account.recent and account.recent[0] < now - ACCOUNT_THROUGHPUT_WINDOW:
+                    account.recent.popleft()
+            elif error_class != 'daily_limit':
+                account.failed += 1
+        self.save_counts()
+
+    def status(self):
+        """Returns the combined rate and remaining daily quota of the usable accounts for progress reporting."""
+        with self._lock:
+            usable = [account for account in self._accounts.values() if account.usable]
+            return {'rate': round(sum(account.limiter.rate for account in usable), 2),
+                    'daily_remaining': sum(account.limiter.remaining_today() for account in usable)}
+
+    def stats(self):
+        """Returns per-account figures for the Account page."""
+        now = time.monotonic()
+        with self._lock:
+            return [{
+                'username': account.username,
+                'weight': account.weight,
+                'daily_limit': account.limiter.daily_limit,
+                'daily_remaining': account.limiter.remaining_today(),
+                'rate': round(account.limiter.rate, 2),
+                'per_minute': sum(1 for sent_at in account.recent if sent_at >= now - ACCOUNT_THROUGHPUT_WINDOW)
+                              * 60 // ACCOUNT_THROUGHPUT_WINDOW,
+                'sent': account.sent,
+                'failed': account.failed,
+                'health': account.health(),
+            } for account in self._accounts.values()]
+
+# Shared by every campaign so each account's daily budget carries across runs
+sender_accounts = SenderAccounts()
+
+def smtp_error_code(error):
+    """Extracts the SMTP reply code from an smtplib exception, if it carries one."""
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code
+    if isinstance(error, smtplib.SMTPRecipientsRefused) and error.recipients:
+        return next(iter(error.recipients.values()))[0]
+    return None
+
+class TemplateText:
+    """A piece of template text pre-split into literal segments and placeholder slots."""
+
+    def __init__(self, text, name_token=False):
+        self.parts = []
+        self.slots = []
+        pos = 0
+        for match in PLACEHOLDER_PATTERN.finditer(text):
+            self._add_literal(text[pos:match.start()], name_token)
+            self._add_slot(match.group(1), match.group(0))
+            pos = match.end()
+        self._add_literal(text[pos:], name_token)
+
+    def _add_literal(self, text, name_token):
+        if not name_token:
+            self.parts.append(text)
+            return
+        pieces = text.split(NAME_TOKEN)
+        self.parts.append(pieces[0])
+        for piece in pieces[1:]:
+            self._add_slot(NAME_FIELD, NAME_TOKEN)
+            self.parts.append(piece)
+
+    def _add_slot(self, field, original):
+        self.slots.append((len(self.parts), field, original))
+        self.parts.append(original)
+
+    def render(self, fields):
+        if not self.slots:
+            return self.parts[0] if len(self.parts) == 1 else "".join(self.parts)
+        parts = self.parts[:]
+        for index, field, original in self.slots:
+            value = fields.get(field)
+            parts[index] = original if value is None else str(value)
+        return "".join(parts)
+
+class CompiledTemplate:
+    """An email template compiled once per campaign: subject line plus body."""
+
+    def __init__(self, lines):
+        self.subject = TemplateText(lines[0].strip() if lines else "No Subject")
+        if len(lines) > 1:
+            # Only the second line carries the legacy "name" token
+            self.body = [TemplateText(lines[1], name_token=True), TemplateText("".join(lines[2:]))]
+        else:
+            self.body = [TemplateText("".join(lines))]
+
+    @property
+    def fields(self):
+        """Names of the recipient fields this template reads."""
+        return {field for text in [self.subject] + self.body for _, field, _ in text.slots}
+
+    def render(self, fields):
+        """Returns the (subject, body) pair for one recipient."""
+        return self.subject.render(fields), "".join(text.render(fields) for text in self.body)
+
+_template_cache = {}
+_template_cache_lock = threading.Lock()
+
+def get_compiled_template(template_file=EMAIL_TEMPLATE_FILE):
+    """Returns the compiled template, recompiling only when the file's mtime or size changed."""
+    stat = os.stat(template_file)
+    key = (stat.st_mtime_ns, stat.st_size)
+    with _template_cache_lock:
+        cached = _template_cache.get(template_file)
+        if cached and cached[0] == key:
+            return cached[1]
+    with metrics.time('template_read'), open(template_file, "r", encoding='utf-8') as f:
+        compiled = CompiledTemplate(f.readlines())
+    with _template_cache_lock:
+        _template_cache[template_file] = (key, compiled)
+    return compiled
+
+def invalidate_template_cache():
+    """Drops compiled templates so the next campaign re-reads the file."""
+    with _template_cache_lock:
+        _template_cache.clear()
+
+def to_wire(text):
+    """Converts serialized message text to the CRLF bytes smtplib puts on the wire."""
+    return LINE_END_PATTERN.sub('\r\n', text).encode('ascii')
+
+def fold_header(name, value):
+    """Serializes one header exactly as Message.as_string() would."""
+    return to_wire(MESSAGE_POLICY.fold(name, value))
+
+def flatten_part(part):
+    """Serializes a MIME part exactly as it appears inside Message.as_string()."""
+    buffer = io.StringIO()
+    Generator(buffer, mangle_from_=False, maxheaderlen=0).flatten(part, unixfrom=False, linesep='\n')
+    return to_wire(buffer.getvalue())
+
+def make_boundary():
+    """Returns a random multipart boundary in the email package's format."""
+    return '=' * 15 + '%0*d' % (len(repr(sys.maxsize - 1)), random.randrange(sys.maxsize)) + '=='
+
+class AttachmentPart:
+    """A file read, base64-encoded and serialized once, reusable in every message of a campaign."""
+
+    def __init__(self, path):
+        self.path = path
+        self.filename = os.path.basename(path)
+        with open(path, 'rb') as attachment:
+            part = MIMEBase('application', 'octet-stream')
+            part.set_payload(attachment.read())
+        encoders.encode_base64(part)
+        part.add_header('Content-Disposition', 'attachment', filename=self.filename)
+        self.data = flatten_part(part)
+
+_attachment_cache = {}
+_attachment_cache_lock = threading.Lock()
+
+def get_attachment_part(path):
+    """Returns the encoded attachment for path, re-encoding only when its mtime or size changed."""
+    stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size)
+    with _attachment_cache_lock:
+        cached = _attachment_cache.get(path)
+        if cached and cached[0] == key:
+            return cached[1]
+    with metrics.time('attachment_encode'):
+        attachment = AttachmentPart(path)
+    with _attachment_cache_lock:
+        _attachment_cache[path] = (key, attachment)
+    return attachment
+
+def invalidate_attachment_cache(path=None):
+    """Drops the cached encoding of one attachment, or of all of them."""
+    with _attachment_cache_lock:
+        if path is None:
+            _attachment_cache.clear()
+        else:
+            _attachment_cache.pop(path, None)
+
+class MessageSkeleton:
+    """A campaign's message pre-serialized around a fixed boundary; only To, a templated subject and the body vary."""
+
+    def __init__(self, sender, compiled, attachments):
+        self.compiled = compiled
+        boundary = make_boundary().encode('ascii')
+        self._head = (fold_header('Content-Type', 'multipart/mixed; boundary="%s"' % boundary.decode('ascii'))
+                      + fold_header('MIME-Version', '1.0'))
+        self._subject = None if compiled.subject.slots else fold_header('Subject', compiled.subject.render({}))
+        self._from = fold_header('From', sender)
+        self._body_head = b'\r\n--' + boundary + b'\r\n' + flatten_part(MIMEText('', _charset="utf-8"))
+        self._tail = b''.join([b'\r\n--' + boundary + b'\r\n' + attachment.data for attachment in attachments]
+                              + [b'\r\n--' + boundary + b'--\r\n'])
+
+    def render(self, receiver, fields):
+        """Returns the per-recipient pieces: templated Subject header (empty when fixed), To header and encoded body."""
+        subject, body = self.compiled.render(fields)
+        return (b'' if self._subject else fold_header('Subject', subject), fold_header('To', receiver),
+                base64.encodebytes(body.encode('utf-8')).replace(b'\n', b'\r\n'))
+
+    def join(self, subject, to, body, sender=None):
+        """Assembles rendered pieces into wire bytes, optionally From another sender than the skeleton's."""
+        return b''.join([
+            self._head,
+            subject or self._subject,
+            self._from if sender is None else fold_header('From', sender),
+            to,
+            self._body_head,
+            body,
+            self._tail,
+        ])
+
+    def build(self, receiver, fields):
+        """Returns the wire bytes of the message for one recipient."""
+        return self.join(*self.render(receiver, fields))
+
+_skeleton_cache = {}
+_skeleton_cache_lock = threading.Lock()
+
+def get_message_skeleton(sender, compiled, attachments):
+    """Returns the skeleton for this sender, template and attachment set, building it on first use."""
+    key = (sender, compiled, tuple(attachments))
+    with _skeleton_cache_lock:
+        skeleton = _skeleton_cache.get(key)
+    if skeleton is None:
+        skeleton = MessageSkeleton(sender, compiled, attachments)
+        with _skeleton_cache_lock:
+            if len(_skeleton_cache) >= 16:
+                _skeleton_cache.clear()
+            _skeleton_cache[key] = skeleton
+    return skeleton
+
+UNDISCLOSED_RECIPIENTS = fold_header('To', 'undisclosed-recipients:;')  # To header of a message sent to a batch
+
+class RecipientBatch:
+    """Recipients whose messages render identically, sent as one message with a RCPT TO per recipient."""
+
+    __slots__ = ('rows', 'receivers', 'subject', 'body')
+
+    def __init__(self, rows, receivers, subject, body):
+        self.rows = rows
+        self.receivers = receivers
+        self.subject = subject
+        self.body = body
+
+    def message(self, sender, compiled, attachments):
+        """Returns the wire bytes of the batch's message from sender."""
+        return get_message_skeleton(sender, compiled, attachments).join(self.subject, UNDISCLOSED_RECIPIENTS,
+                                                                         self.body)
+
+def batch_identical(pending, compiled, attachments, size):
+    """Groups pending (index, entry) items whose messages render identically into RecipientBatches of up to size.
+
+    Recipients are matched on the values of the fields the template reads, so nothing is rendered to find a
+    match. At most BATCH_OPEN_GROUPS groups wait for more members; past that the oldest goes out as it is.
+    """
+    fields = sorted(compiled.fields)
+    skeleton = get_message_skeleton('', compiled, attachments)
+    groups = {}
+
+    def emit(group):
+        if len(group) > 1:
+            index, entry = group[0]
+            try:
+                with metrics.time('build'):
+                    subject, _, body = skeleton.render(entry['Email'], message_fields(
+                        entry['Email'], entry.get("Last_Name", "Valued Customer"), entry))
+            except Exception:
+                pass  # Sent one by one, each recipient gets the render error reported
+            else:
+                yield RecipientBatch([index for index, _ in group], [entry['Email'] for _, entry in group],
+                                     subject, body)
+                return
+        yield from group
+
+    for index, entry in pending:
+        if 'Email' not in entry:
+            yield index, entry
+            continue
+        values = message_fields(entry['Email'], entry.get("Last_Name", "Valued Customer"), entry)
+        key = tuple(None if values.get(field) is None else str(values[field]) for field in fields)
+        group = groups.setdefault(key, [])
+        group.append((index, entry))
+        if len(group) >= size:
+            del groups[key]
+            yield from emit(group)
+        elif len(groups) > BATCH_OPEN_GROUPS:
+            yield from emit(groups.pop(next(iter(groups))))
+    for group in groups.values():
+        yield from emit(group)
+
+def parse_log_line(line):
+    """Parses a 'receiver > status > time[ > detail]' log line into an index row, or None."""
+    parts = line.rstrip("\n").split(" > ", 3)
+    if len(parts) < 3:
+        return None
+    return parts[2][:19], parts[0], parts[1], parts[3] if len(parts) > 3 else None
+
+def open_log_index():
+    """Opens the log index, creating it and importing any existing logs.txt on first use."""
+    db = sqlite3.connect(LOG_INDEX_FILE)
+    db.execute("PRAGMA journal_mode=WAL")
+    if db.execute("PRAGMA user_version").fetchone()[0] == 0:
+        with db:
+            db.execute("""CREATE TABLE IF NOT EXISTS log_entries (
+                              id INTEGER PRIMARY KEY,
+                              logged_at TEXT NOT NULL,
+                              recipient TEXT NOT NULL,
+                              status TEXT NOT NULL,
+                              detail TEXT)""")
+            db.execute("CREATE INDEX IF NOT EXISTS log_entries_recipient ON log_entries (recipient, id)")
+            db.execute("CREATE INDEX IF NOT EXISTS log_entries_status ON log_entries (status, id)")
+            db.execute("CREATE INDEX IF NOT EXISTS log_entries_logged_at ON log_entries (logged_at)")
+            if os.path.exists(LOG_FILE):
+                with open(LOG_FILE, "r", encoding='utf-8', errors='replace') as log_file:
+                    db.executemany("INSERT INTO log_entries (logged_at, recipient, status, detail) VALUES (?, ?, ?, ?)",
+                                   filter(None, map(parse_log_line, log_file)))
+            db.execute("PRAGMA user_version = 1")
+    return db
+
+class LogWriter:
+    """Background writer that takes log entries from a queue and appends them to the log file and index in batches."""
+
+    _STOP = object()
+
+    def __init__(self, path=LOG_FILE):
+        self.path = path
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._db = None
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, daemon=True)
+                    self._thread.start()
+
+    def write(self, entry):
+        """Queues one (logged_at, recipient, status, detail) entry; never blocks on file I/O."""
+        self._ensure_started()
+        self._queue.put(entry)
+
+    def flush(self):
+        """Blocks until every entry queued so far is on disk and in the index."""
+        self._ensure_started()
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait()
+
+    def close(self):
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(self._STOP)
+            self._thread.join()
+
+    def _run(self):
+        try:
+            self._db = open_log_index()
+        except sqlite3.Error:
+            self._db = None
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if isinstance(item, tuple):
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + LOG_FLUSH_INTERVAL
+                if len(batch) < LOG_FLUSH_LINES and time.monotonic() < deadline:
+                    continue
+            self._write(batch)
+            batch = []
+            deadline = None
+            if isinstance(item, threading.Event):
+                item.set()
+            elif item is self._STOP:
+                if self._db is not None:
+                    self._db.close()
+                return
+
+    def _write(self, batch):
+        if not batch:
+            return
+        lines = []
+        for logged_at, recipient, status, detail in batch:
+            line = f"{recipient} > {status} > {logged_at.strftime('%Y-%m-%d %H:%M:%S %p')}"
+            lines.append(f"{line} > {detail}\n" if detail else line + "\n")
+        try:
+            with open(self.path, "a", encoding='utf-8') as log_file:
+                log_file.write("".join(lines))
+            if self._db is not None:
+                with self._db:
+                    self._db.executemany(
+                        "INSERT INTO log_entries (logged_at, recipient, status, detail) VALUES (?, ?, ?, ?)",
+                        [(logged_at.strftime('%Y-%m-%d %H:%M:%S'), recipient, status, detail)
+                         for logged_at, recipient, status, detail in batch])
+            self._rotate()
+        except (OSError, sqlite3.Error):
+            pass
+
+    def _rotate(self):
+        """Moves logs.txt into a compressed archive segment once it passes LOG_ROTATE_BYTES."""
+        if os.path.getsize(self.path) < LOG_ROTATE_BYTES:
+            return
+        os.makedirs(LOG_ARCHIVE_DIRECTORY, exist_ok=True)
+        archive = os.path.join(LOG_ARCHIVE_DIRECTORY, f"logs-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}.txt.gz")
+        with open(self.path, "rb") as source, gzip.open(archive, "wb") as target:
+            shutil.copyfileobj(source, target)
+        open(self.path, "w").close()
+
+log_writer = LogWriter()
+atexit.register(log_writer.close)
+
+def log_send(receiver, success, detail=None):
+    """Logs the outcome of one send to logs.txt and the log index through the background writer."""
+    log_writer.write((datetime.now(), receiver, 'done' if success else 'failed', detail))
+
+def query_logs(recipient=None, status=None, since=None, until=None, before=None, after=None, limit=LOG_PAGE_SIZE):
+    """Returns one page of log entries, newest first, plus whether older and newer pages exist."""
+    clauses, params = [], []
+    if recipient:
+        clauses.append("recipient = ?")
+        params.append(recipient)
+    if status:
+        clauses.append("status = ?")
+        params.append(status)
+    if since:
+        clauses.append("logged_at >= ?")
+        params.append(since)
+    if until:
+        clauses.append("logged_at < ?")
+        params.append((datetime.strptime(until, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d'))
+    if after:
+        clauses.append("id > ?")
+        params.append(int(after))
+        order = "ASC"
+    else:
+        if before:
+            clauses.append("id < ?")
+            params.append(int(before))
+        order = "DESC"
+    where = " WHERE " + " AND ".join(clauses) if clauses else ""
+    db = open_log_index()
+    try:
+        rows = db.execute(f"SELECT id, logged_at, recipient, status, detail FROM log_entries{where} "
+                          f"ORDER BY id {order} LIMIT ?", params + [limit + 1]).fetchall()
+    finally:
+        db.close()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if after:
+        rows.reverse()
+        return rows, True, more
+    return rows, more, bool(before)
+
+def classify_error(error):
+    """Buckets a send exception into the failure classes counted by the progress tracker."""
+    code = smtp_error_code(error)
+    if code in THROTTLE_CODES:
+        return 'throttled'
+    if isinstance(error, smtplib.SMTPAuthenticationError):
+        return 'auth'
+    if code is not None:
+        return 'rejected' if code >= 500 else 'deferred'
+    if isinstance(error, (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError)):
+        return 'connection'
+    return 'other'
+
+def send_personalized_email(receiver, last_name, template_file=EMAIL_TEMPLATE_FILE, attachment_paths=[], pool=None, limiter=None, fields=None):
+    """Sends a personalized email with an optional attachment, borrowing a session from pool and pacing with limiter if given."""
+    success, message, _ = log_result(receiver, deliver_personalized_email(receiver, last_name, template_file,
+                                                                         attachment_paths, pool, limiter, fields))
+    return success, message
+
+def deliver_personalized_email(receiver, last_name, template_file=EMAIL_TEMPLATE_FILE, attachment_paths=[], pool=None, limiter=None, fields=None):
+    """Does the work of send_personalized_email, also returning the failure class (None on success)."""
+    if pool is not None:
+        sender = pool.username
+    else:
+        credentials = load_credentials()
+        if not credentials:
+            return not_sent("No credentials found. Please add your account first.", 'auth')
+        sender, password = credentials
+
+    try:
+        if isinstance(template_file, CompiledTemplate):
+            compiled = template_file
+        else:
+            compiled = get_compiled_template(template_file)
+    except Exception as e:
+        return not_sent(f"Error reading template file: {e}", 'template')
+
+    values = message_fields(receiver, last_name, fields)
+
+    # Resolve attachments; cached parts are shared, not re-encoded
+    attachments = []
+    for attachment_path in attachment_paths:
+        try:
+            if not isinstance(attachment_path, AttachmentPart):
+                attachment_path = get_attachment_part(attachment_path)
+            attachments.append(attachment_path)
+        except Exception as e:
+            return not_sent(f"Error attaching file {attachment_path}: {e}", 'attachment')
+
+    try:
+        with metrics.time('build'):
+            message = get_message_skeleton(sender, compiled, attachments).build(receiver, values)
+    except Exception as e:
+        return not_sent(f"Error building message for {receiver}: {e}", 'template')
+
+    return send_message(sender, receiver, message, pool, limiter, None if pool is not None else password)
+
+def send_message(sender, receiver, message, pool=None, limiter=None, password=None):
+    """Sends built message bytes through pool, or a one-off session with password, pacing with limiter if given."""
+    if limiter is not None:
+        with metrics.time('rate_wait'):
+            allowed = limiter.acquire()
+        if not allowed:
+            return daily_limit_reached(receiver)
+
+    # Send email with error handling and log successful sends
+    try:
+        if pool is not None:
+            pool.sendmail(sender, receiver, message)
+        else:
+            with open_smtp_session(sender, password) as server, metrics.time('data'):
+                server.sendmail(sender, receiver, message)
+    except Exception as e:
+        return finish_send(receiver, limiter, e)
+    return finish_send(receiver, limiter)
+
+async def deliver_async(smtp, receiver, last_name, compiled, attachments, limiter=None, fields=None):
+    """The asyncio engine's deliver_personalized_email, sending through an AsyncSMTPSender."""
+    try:
+        with metrics.time('build'):
+            message = get_message_skeleton(smtp.username, compiled, attachments).build(
+                receiver, message_fields(receiver, last_name, fields))
+    except Exception as e:
+        return not_sent(f"Error building message for {receiver}: {e}", 'template')
+
+    if limiter is not None:
+        with metrics.time('rate_wait'):
+            allowed = await limiter.acquire_async()
+        if not allowed:
+            return daily_limit_reached(receiver)
+
+    try:
+        await smtp.sendmail(smtp.username, receiver, message)
+    except Exception as e:
+        return finish_send(receiver, limiter, e)
+    return finish_send(receiver, limiter)
+
+def send_batch(sender, receivers, message, pool, limiter=None):
+    """Sends one message to every receiver in a single transaction; returns a (success, message, error class) per receiver."""
+    allowed = len(receivers)
+    if limiter is not None:
+        with metrics.time('rate_wait'):
+            allowed = 0
+            while allowed < len(receivers) and limiter.acquire():
+                allowed += 1
+    held = [daily_limit_reached(receiver) for receiver in receivers[allowed:]]
+    if not allowed:
+        return held
+    try:
+        refused = pool.sendmail(sender, receivers[:allowed], message)
+    except smtplib.SMTPRecipientsRefused as e:
+        refused = e.recipients
+    except Exception as e:
+        return finish_batch(receivers[:allowed], limiter, error=e) + held
+    return finish_batch(receivers[:allowed], limiter, refused) + held
+
+async def send_batch_async(smtp, receivers, message, limiter=None):
+    """The asyncio engine's send_batch, sending through an AsyncSMTPSender."""
+    allowed = len(receivers)
+    if limiter is not None:
+        with metrics.time('rate_wait'):
+            allowed = 0
+            while allowed < len(receivers) and await limiter.acquire_async():
+                allowed += 1
+    held = [daily_limit_reached(receiver) for receiver in receivers[allowed:]]
+    if not allowed:
+        return held
+    try:
+        refused = await smtp.sendmail(smtp.username, receivers[:allowed], message)
+    except smtplib.SMTPRecipientsRefused as e:
+        refused = e.recipients
+    except Exception as e:
+        return finish_batch(receivers[:allowed], limiter, error=e) + held
+    return finish_batch(receivers[:allowed], limiter, refused) + held
+
+def finish_batch(receivers, limiter, refused=None, error=None):
+    """finish_send for each receiver of one transaction; the limiter learns from the transaction once."""
+    results = []
+    for position, receiver in enumerate(receivers):
+        failure = error
+        if error is None and receiver in refused:
+            failure = smtplib.SMTPResponseException(*refused[receiver])
+        results.append(finish_send(receiver, limiter if position == 0 else None, failure))
+    return results
+
+def message_fields(receiver, last_name, fields=None):
+    """Builds the placeholder values for one recipient."""
+    values = dict(fields) if fields else {}
+    values.setdefault('Email', receiver)
+    values[NAME_FIELD] = last_name
+    return values
+
+class SendResult(tuple):
+    """The (success, message, error class) outcome of one send attempt, plus the detail the send log records for it."""
+
+    def __new__(cls, success, message, error_class=None, detail=None):
+        result = super().__new__(cls, (success, message, error_class))
+        result.detail = detail
+        return result
+
+def log_result(receiver, result):
+    """Logs the final outcome for receiver; attempts superseded by a retry on another account are never logged."""
+    log_send(receiver, result[0], result.detail)
+    return result
+
+def daily_limit_reached(receiver):
+    return SendResult(False, f"Daily sending limit reached, not sent to: {receiver}", 'daily_limit',
+                      "daily sending limit reached")
+
+def not_sent(message, error_class):
+    """The result for a message that failed before reaching the server."""
+    return SendResult(False, message, error_class, message.replace("\n", " "))
+
+def finish_send(receiver, limiter, error=None):
+    """Feeds one delivery attempt to limiter; returns its SendResult."""
+    if error is not None:
+        if limiter is not None:
+            limiter.record(False, smtp_error_code(error))
+        return SendResult(False, f"Error sending email to {receiver}: {error}", classify_error(error),
+                          str(error).replace("\n", " "))
+
+    if limiter is not None:
+        limiter.record(True)
+    return SendResult(True, f"Message sent successfully to: {receiver}")
+
+class CampaignJournal:
+    """Append-only record of each recipient's outcome in a campaign, fsynced in batches so a restart can resume."""
+
+    def __init__(self, campaign_id, rows):
+        os.makedirs(JOURNAL_DIRECTORY, exist_ok=True)
+        self.campaign_id = campaign_id
+        self.path = os.path.join(JOURNAL_DIRECTORY, campaign_id + ".journal")
+        self.rows = rows
+        self.delivered = bytearray((rows + 7) // 8)
+        self.resumed = 0
+        self.failed = 0
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='ascii', errors='replace') as f:
+                for line in f:
+                    # A torn last line from a crash simply fails to parse
+                    parts = line.split()
+                    if len(parts) == 2 and parts[1] == 'S' and parts[0].isdigit() and int(parts[0]) < rows:
+                        self._mark(int(parts[0]))
+            self.resumed = sum(bin(byte).count('1') for byte in self.delivered)
+        self._file = open(self.path, 'a', encoding='ascii')
+        self._pending = 0
+        self._synced = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _mark(self, index):
+        self.delivered[index >> 3] |= 1 << (index & 7)
+
+    def is_delivered(self, index):
+        return self.delivered[index >> 3] & (1 << (index & 7))
+
+    def record(self, index, success, error_class=None):
+        """Appends one outcome, failures of any class alike; the file is fsynced every JOURNAL_SYNC_EVERY records or JOURNAL_SYNC_INTERVAL seconds."""
+        with self._lock:
+            self._file.write(f"{index} {'S' if success else 'F'}\n")
+            if success:
+                self._mark(index)
+            else:
+                self.failed += 1
+            self._pending += 1
+            if self._pending >= JOURNAL_SYNC_EVERY or time.monotonic() - self._synced >= JOURNAL_SYNC_INTERVAL:
+                self._sync()
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._pending = 0
+        self._synced = time.monotonic()
+
+    def close(self, completed):
+        """Syncs the journal; a fully delivered campaign's journal is retired so the next run starts fresh."""
+        with self._lock:
+            self._sync()
+            self._file.close()
+        if completed:
+            os.replace(self.path, os.path.splitext(self.path)[0] + ".done")
+
+def campaign_fingerprint(attachments, template_file=EMAIL_TEMPLATE_FILE):
+    """Identifies the template and attachments a campaign sends."""
+    digest = hashlib.sha1()
+    with open(template_file, 'rb') as f:
+        digest.update(f.read())
+    for attachment in attachments:
+        digest.update(attachment.data)
+    return digest.hexdigest()
+
+def campaign_id(header, fingerprint):
+    """Identifies a campaign by the recipient store it sends to and what it sends, so only a rerun of the same campaign resumes."""
+    return f"{header['rows']}-{header['checksum']}-{fingerprint[:12]}"
+
+def next_account(receiver, tried, result):
+    """Decides the next attempt for receiver: returns (account, None, None), (None, seconds to wait, None) or (None, None, final result)."""
+    if result is not None and result[2] not in ACCOUNT_RETRY_ERRORS:
+        return None, None, result
+    account, wait = sender_accounts.choose(exclude=tried)
+    if account is not None or wait is not None:
+        return account, wait, None
+    if result is not None:
+        return None, None, result
+    return None, None, no_account_result(receiver)
+
+def no_account_result(receiver):
+    """The result for a receiver no account was tried for: every account is out of quota or failed to authenticate."""
+    if any(account.auth_failed for account in sender_accounts.accounts()):
+        return SendResult(False, f"No usable sender account, not sent to: {receiver}", 'auth', "no usable sender account")
+    return daily_limit_reached(receiver)
+
+def deliver_with_accounts(receiver, send):
+    """Calls send(account) with the next account in rotation, moving on to another account on account-level failures."""
+    tried = []
+    result = None
+    while True:
+        account, wait, final = next_account(receiver, tried, result)
+        if final is not None:
+            return log_result(receiver, final)
+        if account is None:
+            time.sleep(wait)
+            continue
+        result = send(account)
+        sender_accounts.record(account, result[2])
+        tried.append(account)
+
+async def deliver_async_with_accounts(senders, receiver, last_name, compiled, attachments, fields=None):
+    """The asyncio engine's deliver_with_accounts; senders maps usernames to this worker's AsyncSMTPSenders."""
+    tried = []
+    result = None
+    while True:
+        account, wait, final = next_account(receiver, tried, result)
+        if final is not None:
+            return log_result(receiver, final)
+        if account is None:
+            await asyncio.sleep(wait)
+            continue
+        if account.username not in senders:
+            senders[account.username] = AsyncSMTPSender(*account.credentials)
+        result = await deliver_async(senders[account.username], receiver, last_name, compiled, attachments,
+                                     account.limiter, fields)
+        sender_accounts.record(account, result[2])
+        tried.append(account)
+
+def deliver_batch_with_accounts(receivers, send):
+    """deliver_with_accounts for a batch: send(account, receivers) returns a result per receiver, and the receivers
+    hit by an account-level failure move on to the next account together."""
+    results = [None] * len(receivers)
+    pending = list(range(len(receivers)))
+    tried = []
+    while pending:
+        account, wait = sender_accounts.choose(exclude=tried)
+        if account is None:
+            if wait is not None:
+                time.sleep(wait)
+                continue
+            for position in pending:
+                results[position] = results[position] or no_account_result(receivers[position])
+            break
+        record_batch_health(account, pending, results, send(account, [receivers[position] for position in pending]))
+        tried.append(account)
+        pending = [position for position in pending if results[position][2] in ACCOUNT_RETRY_ERRORS]
+    for receiver, result in zip(receivers, results):
+        log_result(receiver, result)
+    return results
+
+async def deliver_batch_async_with_accounts(senders, receivers, send):
+    """The asyncio engine's deliver_batch_with_accounts; send(smtp, account, receivers) is awaited."""
+    results = [None] * len(receivers)
+    pending = list(range(len(receivers)))
+    tried = []
+    while pending:
+        account, wait = sender_accounts.choose(exclude=tried)
+        if account is None:
+            if wait is not None:
+                await asyncio.sleep(wait)
+                continue
+            for position in pending:
+                results[position] = results[position] or no_account_result(receivers[position])
+            break
+        if account.username not in senders:
+            senders[account.username] = AsyncSMTPSender(*account.credentials)
+        outcome = await send(senders[account.username], account, [receivers[position] for position in pending])
+        record_batch_health(account, pending, results, outcome)
+        tried.append(account)
+        pending = [position for position in pending if results[position][2] in ACCOUNT_RETRY_ERRORS]
+    for receiver, result in zip(receivers, results):
+        log_result(receiver, result)
+    return results
+
+def record_batch_health(account, pending, results, outcome):
+    """Stores a batch attempt's outcome; account health learns from the transaction once, the counters from every receiver."""
+    primary = next((position for position, result in enumerate(outcome) if result[0]), 0)
+    for position, result in enumerate(outcome):
+        if position == primary:
+            sender_accounts.record(account, result[2])
+        else:
+            sender_accounts.count(account.username, result[2])
+        results[pending[position]] = result
+
+def record_batch(batch, results, journal, elapsed):
+    """Journals and reports each receiver of a sent RecipientBatch."""
+    for index, (success, message, error_class) in zip(batch.rows, results):
+        journal.record(index, success, error_class)
+        email_progress.record(success, message, error_class, skipped=error_class == 'daily_limit', elapsed=elapsed)
+
+def record_worker_error(rows, error, journal):
+    """Fails the given (row, receiver) pairs after an unexpected error, so one bad entry cannot stop a send worker."""
+    for index, receiver in rows:
+        journal.record(index, False, 'other')
+        result = not_sent(f"Unexpected error sending row {index}: {error}", 'other')
+        email_progress.record(*log_result(receiver, result))
+
+def item_rows(item):
+    """Returns the (row, receiver) pairs a send worker's queue item covers."""
+    if isinstance(item, RecipientBatch):
+        return list(zip(item.rows, item.receivers))
+    return [(item[0], item[1].get('Email', ''))]
+
+def send_emails_thread(workers=DEFAULT_SEND_WORKERS, engine=DEFAULT_SEND_ENGINE, profile=False, batch=SEND_BATCH_SIZE):
+    """Send emails in a separate thread to avoid blocking the web interface, optionally under the sampling profiler.
+
+    With batch above 1, recipients whose messages render identically share transactions of up to batch recipients.
+    """
+    header = read_recipient_header(RECIPIENTS_FILE)
+    if not header or not os.path.exists(RECIPIENTS_FILE):
+        email_progress.fail("No data found. Please scan first.")
+        return
+    
+    accounts = sender_accounts.load()
+    if not accounts:
+        email_progress.fail("No credentials found. Please add your account first.")
+        return
+    sender_accounts.reset_health()
+
+    try:
+        create_default_template()
+        compiled = get_compiled_template(EMAIL_TEMPLATE_FILE)
+    except Exception as e:
+        email_progress.fail(f"Error reading template file: {e}")
+        return
+
+    try:
+        attachments = [get_attachment_part(os.path.join(FILES_DIRECTORY, file)) for file in get_attachment_files()]
+    except Exception as e:
+        email_progress.fail(f"Error attaching file: {e}")
+        return
+
+    try:
+        journal = CampaignJournal(campaign_id(header, campaign_fingerprint(attachments)), header['rows'])
+    except Exception as e:
+        email_progress.fail(f"Error opening campaign journal: {e}")
+        return
+
+    if engine == 'asyncio':
+        run, limit = send_async, MAX_ASYNC_SESSIONS
+    elif engine == 'processes':
+        run, limit = send_processes, MAX_SEND_WORKERS
+    elif engine == 'spool':
+        run, limit = send_spooled, MAX_SEND_WORKERS
+    else:
+        run, limit = send_threaded, MAX_SEND_WORKERS
+    workers = max(1, min(int(workers), limit))
+    batch = max(1, min(int(batch), MAX_SEND_BATCH))
+    
+    email_progress.update(total=header['rows'], skipped=journal.resumed, resumed=journal.resumed,
+                          status='sending', workers=workers * (SEND_PROCESSES if engine == 'processes' else 1),
+                          engine=engine)
+    
+    # Rows delivered before a restart are skipped; rows appended since the campaign started are left for the next one
+    pending = ((index, entry) for index, entry in enumerate(itertools.islice(iter_recipients(RECIPIENTS_FILE),
+                                                                             header['rows']))
+               if not journal.is_delivered(index))
+    profiler = SamplingProfiler().start() if profile else None
+    completed = False
+    try:
+        run(pending, accounts, compiled, attachments, journal, workers, batch)
+        completed = True
+    except Exception as e:
+        email_progress.record(False, f"Error reading recipients: {e}", 'recipients')
+    finally:
+        journal.close(completed and not journal.failed)
+        log_writer.flush()
+        sender_accounts.save_counts(force=True)
+        if profiler is not None:
+            path = os.path.join(PROFILE_DIRECTORY, f"{journal.campaign_id}-{datetime.now():%Y%m%d-%H%M%S}.folded")
+            email_progress.update(profile=profiler.stop(path))
+    
+    email_progress.update(status='completed' if completed else 'error')
+
+def send_threaded(pending, accounts, compiled, attachments, journal, workers, batch=1):
+    """Thread engine: workers threads sharing one pool of blocking smtplib sessions per account."""
+    if batch > 1:
+        pending = batch_identical(pending, compiled, attachments, batch)
+    pools = AccountPools(workers)
+    recipients = queue.Queue(maxsize=workers * 4)
+    metrics.queue = recipients
+    threads = [threading.Thread(target=send_worker, args=(recipients, compiled, attachments, pools, journal), daemon=True)
+               for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    try:
+        for item in pending:
+            recipients.put(item)
+    finally:
+        for _ in threads:
+            recipients.put(None)
+        for thread in threads:
+            thread.join()
+        pools.close()
+        metrics.queue = None
+
+def send_worker(recipients, compiled, attachments, pools, journal):
+    """Sends to entries pulled from the shared recipient queue until it receives None."""
+    while True:
+        item = recipients.get()
+        if item is None:
+            return
+
+        try:
+            if isinstance(item, RecipientBatch):
+                started = time.perf_counter()
+                results = deliver_batch_with_accounts(item.receivers, lambda account, receivers: send_batch(
+                    account.username, receivers, item.message(account.username, compiled, attachments),
+                    pools[account.username], account.limiter))
+                record_batch(item, results, journal, time.perf_counter() - started)
+                continue
+
+            index, entry = item
+            if 'Email' not in entry:
+                journal.record(index, False)
+                email_progress.record(*log_result('', not_sent(f"Missing email address for entry: {entry}",
+                                                               'missing_email')))
+                continue
+
+            receiver = entry['Email']
+            last_name = entry.get("Last_Name", "Valued Customer")
+
+            started = time.perf_counter()
+            success, message, error_class = deliver_with_accounts(receiver, lambda account: deliver_personalized_email(
+                receiver, last_name, compiled, attachments, pools[account.username], account.limiter, entry))
+            journal.record(index, success, error_class)
+            email_progress.record(success, message, error_class, skipped=error_class == 'daily_limit',
+                                  elapsed=time.perf_counter() - started)
+        except Exception as e:
+            record_worker_error(item_rows(item), e, journal)
+
+def send_async(pending, accounts, compiled, attachments, journal, sessions, batch=1):
+    """Asyncio engine: sessions concurrent SMTP sessions multiplexed on one event loop in this thread."""
+    if batch > 1:
+        pending = batch_identical(pending, compiled, attachments, batch)
+    local_hostname()
+    asyncio.run(run_async_campaign(pending, compiled, attachments, journal, sessions))
+
+async def run_async_campaign(pending, compiled, attachments, journal, sessions):
+    recipients = asyncio.Queue(maxsize=sessions * 4)
+    metrics.queue = recipients
+    workers = [asyncio.create_task(async_send_worker(recipients, compiled, attachments, journal))
+               for _ in range(sessions)]
+    try:
+        for item in pending:
+            await recipients.put(item)
+    finally:
+        for _ in workers:
+            await recipients.put(None)
+        await asyncio.gather(*workers)
+        metrics.queue = None
+
+async def async_send_worker(recipients, compiled, attachments, journal):
+    """The asyncio engine's send_worker; each worker keeps one SMTP session per account it has used."""
+    senders = {}
+    try:
+        while True:
+            item = await recipients.get()
+            if item is None:
+                return
+
+            try:
+                if isinstance(item, RecipientBatch):
+                    started = time.perf_counter()
+                    results = await deliver_batch_async_with_accounts(
+                        senders, item.receivers, lambda smtp, account, receivers: send_batch_async(
+                            smtp, receivers, item.message(account.username, compiled, attachments), account.limiter))
+                    record_batch(item, results, journal, time.perf_counter() - started)
+                    continue
+
+                index, entry = item
+                if 'Email' not in entry:
+                    journal.record(index, False)
+                    email_progress.record(*log_result('', not_sent(f"Missing email address for entry: {entry}",
+                                                                   'missing_email')))
+                    continue
+
+                receiver = entry['Email']
+                last_name = entry.get("Last_Name", "Valued Customer")
+
+                started = time.perf_counter()
+                success, message, error_class = await deliver_async_with_accounts(
+                    senders, receiver, last_name, compiled, attachments, entry)
+                journal.record(index, success, error_class)
+                email_progress.record(success, message, error_class, skipped=error_class == 'daily_limit',
+                                      elapsed=time.perf_counter() - started)
+            except Exception as e:
+                record_worker_error(item_rows(item), e, journal)
+    finally:
+        for smtp in senders.values():
+            await smtp.close()
+
+class ShardOutbox:
+    """Batches calls made in a shard process and ships them to the web process over a multiprocessing queue."""
+
+    def __init__(self, shard, results, accounts):
+        self.shard = shard
+        self.results = results
+        self.accounts = accounts
+        self._calls = []
+        self._flushed = time.monotonic()
+        self._lock = threading.Lock()
+
+    def put(self, call):
+        with self._lock:
+            self._calls.append(call)
+            if len(self._calls) >= SHARD_BATCH or time.monotonic() - self._flushed >= SHARD_FLUSH_INTERVAL:
+                self._flush()
+
+    def _flush(self):
+        # Also report how much of each account's daily budget the shard has used so the web process can charge it
+        used = {account.username: account.limiter.daily_limit - account.limiter.remaining_today()
+                for account in self.accounts}
+        self.results.put(('batch', self.shard, self._calls, used, metrics.drain()))
+        self._calls = []
+        self._flushed = time.monotonic()
+
+    def close(self, error=None):
+        with self._lock:
+            self._flush()
+        self.results.put(('done', self.shard, error, None, metrics.drain()))
+
+class ShardProxy:
+    """Stands in for the journal, progress tracker, log writer or account counters inside a shard; calls are replayed in the web process."""
+
+    def __init__(self, outbox, target):
+        self._outbox = outbox
+        self._target = target
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self._outbox.put((self._target, name, args, kwargs))
+
+def send_shard(shard, shards, settings, accounts, compiled, attachments, rows, delivered, workers, batch, results):
+    """Entry point of a shard process: sends the rows whose index % shards == shard with its own pools."""
+    global email_progress, log_writer, sender_accounts
+    # The process starts from a fresh import, so runtime settings come from the web process
+    globals().update(settings)
+    sender_accounts = SenderAccounts(path=None, counts_path=None)
+    for username, password, weight, limits in accounts:
+        sender_accounts.add(SenderAccount(username, password, weight=weight, limiter=RateLimiter(**limits)))
+    accounts = sender_accounts.accounts()
+    outbox = ShardOutbox(shard, results, accounts)
+    email_progress = ShardProxy(outbox, 'progress')
+    log_writer = ShardProxy(outbox, 'log')
+    sender_accounts.count = ShardProxy(outbox, 'accounts').count
+    # Pick this shard's lines before decoding them, so each row is parsed by one process only
+    lines = itertools.islice(iter_recipient_lines(RECIPIENTS_FILE), shard, rows, shards)
+    pending = ((index, json.loads(line)) for index, line in zip(range(shard, rows, shards), lines)
+               if not delivered[index >> 3] & (1 << (index & 7)))
+    error = None
+    try:
+        send_threaded(pending, accounts, compiled, attachments, ShardProxy(outbox, 'journal'), workers, batch)
+    except Exception as e:
+        error = f"Shard {shard}: {e}"
+    outbox.close(error)
+
+def send_processes(pending, accounts, compiled, attachments, journal, workers, batch=1):
+    """Process engine: SEND_PROCESSES shard processes each run the thread engine with workers threads.
+
+    Shards read the recipient store themselves; the journal, progress and log stay in this process,
+    fed with the calls the shards make.
+    """
+    pending.close()
+    shards = SEND_PROCESSES
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    settings = {name: globals()[name] for name in SHARD_SETTINGS}
+    processes = []
+    for shard in range(shards):
+        shares = [(account.username, account.password, account.weight, account.limiter.share(shard, shards))
+                  for account in accounts]
+        processes.append(context.Process(target=send_shard, daemon=True,
+                                         args=(shard, shards, settings, shares, compiled, attachments,
+                                               journal.rows, bytes(journal.delivered), workers, batch, results)))
+    for process in processes:
+        process.start()
+
+    targets = {'journal': journal, 'progress': email_progress, 'log': log_writer, 'accounts': sender_accounts}
+    used = [{} for _ in range(shards)]
+    errors = []
+    running = shards
+    while running:
+        try:
+            kind, shard, payload, shard_used, shard_metrics = results.get(timeout=1)
+        except queue.Empty:
+            if not any(process.is_alive() for process in processes):
+                errors.append("A send process exited unexpectedly.")
+                break
+            continue
+        metrics.merge(shard, shard_metrics)
+        if kind == 'done':
+            running -= 1
+            metrics.forget(shard)
+            if payload:
+                errors.append(payload)
+            continue
+        for target, name, args, kwargs in payload:
+            getattr(targets[target], name)(*args, **kwargs)
+        for username, count in shard_used.items():
+            account = sender_accounts.get(username)
+            if account is not None:
+                account.limiter.charge(count - used[shard].get(username, 0))
+        used[shard] = shard_used
+        sender_accounts.save_counts()
+    for process in processes:
+        process.join()
+    for shard in range(shards):
+        metrics.forget(shard)
+    if errors:
+        raise RuntimeError("; ".join(errors))
+
+SPOOL_RECORD = struct.Struct('<QIIIIIB')  # Message offset, row, receiver/Subject/To/body lengths, state
+SPOOL_PENDING, SPOOL_DELIVERED, SPOOL_FAILED, SPOOL_TEMPLATE_ERROR, SPOOL_MISSING_EMAIL = range(5)
+SPOOL_RENDER_ERRORS = {SPOOL_TEMPLATE_ERROR: 'template', SPOOL_MISSING_EMAIL: 'missing_email'}
+
+class CampaignSpool:
+    """A campaign rendered to disk ahead of delivery, kept across restarts until every message is delivered.
+
+    What every message shares is stored once (parts.json, and tail.bin for the attachments). Each message adds
+    its receiver, Subject, To and body bytes to messages.bin and a fixed-size record to index.bin; the record's
+    last byte is its state, rewritten in place as the message is delivered or fails.
+    """
+
+    def __init__(self, campaign_id, compiled, attachments):
+        self.path = os.path.join(SPOOL_DIRECTORY, campaign_id)
+        self._parts_path = os.path.join(self.path, "parts.json")
+        self._messages_path = os.path.join(self.path, "messages.bin")
+        self._index_path = os.path.join(self.path, "index.bin")
+        self._skeleton = MessageSkeleton('', compiled, attachments)
+        fingerprint = campaign_fingerprint(attachments)
+        try:
+            with open(self._parts_path, 'r', encoding='utf-8') as f:
+                self._parts = json.load(f)
+        except (OSError, ValueError):
+            self._parts = None
+        if self._parts is None or self._parts.get('fingerprint') != fingerprint:
+            # Spooled with another template or attachments: render again, the journal still skips delivered rows
+            shutil.rmtree(self.path, ignore_errors=True)
+            os.makedirs(self.path)
+            with open(os.path.join(self.path, "tail.bin"), 'wb') as f:
+                f.write(self._skeleton._tail)
+            self._parts = {'fingerprint': fingerprint, 'rendered': False,
+                           'head': base64.b64encode(self._skeleton._head).decode('ascii'),
+                           'subject': base64.b64encode(self._skeleton._subject or b'').decode('ascii'),
+                           'body_head': base64.b64encode(self._skeleton._body_head).decode('ascii')}
+            self._save_parts()
+        self._head = base64.b64decode(self._parts['head'])
+        self._subject = base64.b64decode(self._parts['subject'])
+        self._body_head = base64.b64decode(self._parts['body_head'])
+        with open(os.path.join(self.path, "tail.bin"), 'rb') as f:
+            self._tail = f.read()
+
+        self.count, self.last_row, self._end = self._recover()
+        self.rendered = self._parts['rendered']
+        self.error = None
+        self.changed = threading.Condition()
+        self._messages = open(self._messages_path, 'ab')
+        self._index = open(self._index_path, 'ab')
+        self._unpublished = 0
+        self._published = time.monotonic()
+        # Unbuffered, so delivery always sees what the render stage has flushed
+        self._reader = open(self._messages_path, 'rb', buffering=0)
+        self._records = open(self._index_path, 'r+b', buffering=0)
+        self._lock = threading.Lock()
+
+    def _save_parts(self):
+        temporary = self._parts_path + ".tmp"
+        with open(temporary, 'w', encoding='utf-8') as f:
+            json.dump(self._parts, f)
+        os.replace(temporary, self._parts_path)
+
+    def _recover(self):
+        """Drops records and message bytes a crash left half-written; returns (records, last row, messages size)."""
+        for path in (self._messages_path, self._index_path):
+            open(path, 'ab').close()
+        size = os.path.getsize(self._messages_path)
+        count = os.path.getsize(self._index_path) // SPOOL_RECORD.size
+        last_row, end = -1, 0
+        with open(self._index_path, 'r+b') as index:
+            while count:
+                index.seek((count - 1) * SPOOL_RECORD.size)
+                record = SPOOL_RECORD.unpack(index.read(SPOOL_RECORD.size))
+                if record[0] + sum(record[2:6]) <= size:
+                    last_row, end = record[1], record[0] + sum(record[2:6])
+                    break
+                count -= 1
+            index.truncate(count * SPOOL_RECORD.size)
+        with open(self._messages_path, 'r+b') as messages:
+            messages.truncate(end)
+        return count, last_row, end
+
+    def add(self, index, entry):
+        """Renders one recipient into the spool; a row that cannot be rendered is spooled with its error instead."""
+        receiver = entry.get('Email')
+        subject = to = b''
+        state = SPOOL_PENDING
+        if receiver is None:
+            state, receiver = SPOOL_MISSING_EMAIL, ''
+            body = f"Missing email address for entry: {entry}".encode('utf-8')
+        else:
+            try:
+                with metrics.time('render'):
+                    subject, to, body = self._skeleton.render(receiver, message_fields(
+                        receiver, entry.get("Last_Name", "Valued Customer"), entry))
+            except Exception as e:
+                state = SPOOL_TEMPLATE_ERROR
+                body = f"Error building message for {receiver}: {e}".encode('utf-8')
+        receiver = receiver.encode('utf-8')
+        self._messages.write(receiver + subject + to + body)
+        self._index.write(SPOOL_RECORD.pack(self._end, index, len(receiver), len(subject), len(to), len(body), state))
+        self._end += len(receiver) + len(subject) + len(to) + len(body)
+        self.last_row = index
+        self._unpublished += 1
+        if self._unpublished >= SPOOL_PUBLISH_EVERY or time.monotonic() - self._published >= SPOOL_PUBLISH_INTERVAL:
+            self._publish()
+
+    def _publish(self):
+        # Message bytes reach the file before the records pointing at them
+        self._messages.flush()
+        self._index.flush()
+        with self.changed:
+            self.count += self._unpublished
+            self.changed.notify_all()
+        self._unpublished = 0
+        self._published = time.monotonic()
+
+    def finish(self, error=None):
+        """Ends the render stage; a spool rendered to the end is not rendered again after a restart."""
+        if not self.rendered:
+            self._publish()
+            for f in (self._messages, self._index):
+                os.fsync(f.fileno())
+            if error is None:
+                self._parts['rendered'] = True
+                self._save_parts()
+        with self.changed:
+            self.error = error
+            self.rendered = True
+            self.changed.notify_all()
+
+    def wait_for(self, number):
+        """Blocks until record number is spooled and returns True, or returns False once rendering ended before it."""
+        with self.changed:
+            self.changed.wait_for(lambda: number < self.count or self.rendered)
+            return number < self.count
+
+    def record(self, number):
+        """Returns (offset, row, receiver, Subject, To and body lengths, state) of one spooled message."""
+        with self._lock:
+            self._records.seek(number * SPOOL_RECORD.size)
+            return SPOOL_RECORD.unpack(self._records.read(SPOOL_RECORD.size))
+
+    def read(self, record):
+        """Returns the receiver and the rendered Subject, To and body bytes of a record."""
+        offset, _, *lengths, _ = record
+        with self._lock:
+            self._reader.seek(offset)
+            data = self._reader.read(sum(lengths))
+        receiver, subject, to, body = (data[start:start + length] for start, length in
+                                       zip(itertools.accumulate([0] + lengths[:-1]), lengths))
+        return receiver.decode('utf-8'), subject, to, body
+
+    def message(self, subject, to, body, sender):
+        """Assembles a spooled message's wire bytes From sender."""
+        return b''.join([self._head, subject or self._subject, fold_header('From', sender), to, self._body_head, body,
+                         self._tail])
+
+    def mark(self, number, state):
+        with self._lock:
+            self._records.seek(number * SPOOL_RECORD.size + SPOOL_RECORD.size - 1)
+            self._records.write(bytes([state]))
+
+    def close(self, completed):
+        """Closes the spool files; a fully delivered campaign's spool is deleted."""
+        for f in (self._messages, self._index, self._reader, self._records):
+            f.close()
+        if completed:
+            shutil.rmtree(self.path, ignore_errors=True)
+
+def render_spool(spool, pending):
+    """Render stage: spools every pending row after the last one already spooled."""
+    error = None
+    try:
+        if spool.rendered:
+            pending.close()
+        else:
+            for index, entry in pending:
+                if index > spool.last_row:
+                    spool.add(index, entry)
+    except Exception as e:
+        error = e
+    spool.finish(error)
+
+def send_spooled(pending, accounts, compiled, attachments, journal, workers, batch=1):
+    """Spool engine: a render thread writes the campaign to a spool while workers threads deliver from it.
+
+    Rendering never waits on SMTP, a row that fails to render is reported without stopping the campaign,
+    and a restarted campaign reuses what was already spooled. Spooled messages are addressed to one
+    recipient each, so batch is not used.
+    """
+    spool = CampaignSpool(journal.campaign_id, compiled, attachments)
+    renderer = threading.Thread(target=render_spool, args=(spool, pending), daemon=True)
+    renderer.start()
+    pools = AccountPools(workers)
+    records = queue.Queue(maxsize=workers * 4)
+    metrics.queue = records
+    threads = [threading.Thread(target=spool_worker, args=(records, spool, pools, journal), daemon=True)
+               for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    drained = False
+    try:
+        number = 0
+        while spool.wait_for(number):
+            record = spool.record(number)
+            if record[-1] == SPOOL_DELIVERED:
+                if not journal.is_delivered(record[1]):
+                    # Delivered just before a restart, after the journal last synced
+                    journal.record(record[1], True)
+                    email_progress.resume()
+            elif not journal.is_delivered(record[1]):
+                # Failed messages are retried, as the journal retries failed rows
+                records.put((number, record))
+            number += 1
+        drained = True
+    finally:
+        for _ in threads:
+            records.put(None)
+        for thread in threads:
+            thread.join()
+        pools.close()
+        metrics.queue = None
+        renderer.join()
+        spool.close(drained and spool.error is None and not journal.failed)
+    if spool.error is not None:
+        raise spool.error
+
+def spool_worker(records, spool, pools, journal):
+    """Delivers spooled messages pulled from the shared queue until it receives None."""
+    while True:
+        item = records.get()
+        if item is None:
+            return
+        number, record = item
+        index, state = record[1], record[-1]
+        receiver = ''
+        try:
+            receiver, subject, to, body = spool.read(record)
+
+            if state in SPOOL_RENDER_ERRORS:
+                journal.record(index, False)
+                result = not_sent(body.decode('utf-8'), SPOOL_RENDER_ERRORS[state])
+                email_progress.record(*log_result(receiver, result))
+                continue
+
+            started = time.perf_counter()
+            success, message, error_class = deliver_with_accounts(receiver, lambda account: send_message(
+                account.username, receiver, spool.message(subject, to, body, account.username), pools[account.username],
+                account.limiter))
+            spool.mark(number, SPOOL_DELIVERED if success else SPOOL_FAILED)
+            journal.record(index, success, error_class)
+            email_progress.record(success, message, error_class, skipped=error_class == 'daily_limit',
+                                  elapsed=time.perf_counter() - started)
+        except Exception as e:
+            record_worker_error([(index, receiver)], e, journal)
+
+JOB_PENDING, JOB_SENT, JOB_FAILED = range(3)  # States of a job's recipients
+
+def open_job_queue(path=JOBS_FILE):
+    """Opens the job queue database, creating its tables on first use."""
+    db = sqlite3.connect(path)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.row_factory = sqlite3.Row
+    if db.execute("PRAGMA user_version").fetchone()[0] == 0:
+        with db:
+            db.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                              id INTEGER PRIMARY KEY,
+                              name TEXT NOT NULL,
+                              status TEXT NOT NULL,
+                              priority INTEGER NOT NULL,
+                              scheduled_at TEXT NOT NULL,
+                              created_at TEXT NOT NULL,
+                              template TEXT NOT NULL,
+                              attachments TEXT NOT NULL,
+                              engine TEXT NOT NULL,
+                              workers INTEGER NOT NULL,
+                              total INTEGER NOT NULL DEFAULT 0,
+                              sent INTEGER NOT NULL DEFAULT 0,
+                              failed INTEGER NOT NULL DEFAULT 0,
+                              error TEXT)""")
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_due ON jobs (status, priority, scheduled_at)")
+            db.execute("""CREATE TABLE IF NOT EXISTS job_recipients (
+                              job_id INTEGER NOT NULL,
+                              row INTEGER NOT NULL,
+                              entry TEXT NOT NULL,
+                              state INTEGER NOT NULL DEFAULT 0,
+                              PRIMARY KEY (job_id, row)) WITHOUT ROWID""")
+            # Only unsent recipients are indexed, so taking the next batch never walks past sent ones
+            db.execute("CREATE INDEX IF NOT EXISTS job_recipients_pending ON job_recipients (job_id, row) "
+                       "WHERE state = 0")
+            db.execute("PRAGMA user_version = 1")
+    return db
+
+class JobQueue:
+    """Campaign jobs and their recipients in jobs.db; every call uses its own connection, so any thread may call."""
 
-app = Flask(__name__)
-app.secret_key = secrets.token_hex(16)
+    def __init__(self, path=JOBS_FILE):
+        self.path = path
 
-# Configuration
-EMAIL_TEMPLATE_FILE = "EmailTemplate/template1.txt"
-CREDENTIALS_FILE = "credentials.txt"
-EXTRACTED_DATA_FILE = "extracted_data.json"
-FILES_DIRECTORY = "Files"
+    @contextmanager
+    def _connect(self):
+        db = open_job_queue(self.path)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
 
-# Initialize directories
-os.makedirs("EmailTemplate", exist_ok=True)
-os.makedirs(FILES_DIRECTORY, exist_ok=True)
-os.makedirs("templates", exist_ok=True)
+    def enqueue(self, name, entries, template, attachments, engine=DEFAULT_JOB_ENGINE, workers=DEFAULT_SEND_WORKERS,
+                priority=0, scheduled_at=None):
+        """Queues a job sending template to every (row, entry) in entries; returns its id."""
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        with self._connect() as db:
+            job_id = db.execute("INSERT INTO jobs (name, status, priority, scheduled_at, created_at, template, "
+                                "attachments, engine, workers) VALUES (?, 'queued', ?, ?, ?, ?, ?, ?, ?)",
+                                (name, priority, scheduled_at or now, now, template, json.dumps(attachments),
+                                 engine, workers)).lastrowid
+            total = db.executemany("INSERT INTO job_recipients (job_id, row, entry) VALUES (?, ?, ?)",
+                                   ((job_id, row, json.dumps(entry)) for row, entry in entries)).rowcount
+            db.execute("UPDATE jobs SET total = ? WHERE id = ?", (total, job_id))
+        return job_id
 
-# Global variable to track email sending progress
-email_progress = {
-    'current': 0,
-    'total': 0,
-    'status': 'idle',
-    'results': []
-}
+    def jobs(self, limit=JOB_PAGE_SIZE):
+        """Returns the newest jobs as dicts."""
+        with self._connect() as db:
+            return [dict(job) for job in db.execute("SELECT id, name, status, priority, scheduled_at, created_at, engine, "
+                                                    "workers, total, sent, failed, error FROM jobs "
+                                                    "ORDER BY id DESC LIMIT ?", (limit,))]
 
-def count_emails(file_path):
-    """Counts the total number of emails in a JSON file."""
-    try:
-        with open(file_path, 'r') as f:
-            data = json.load(f)
+    def set_status(self, job_id, status, allowed):
+        """Moves a job to status if it is currently in one of allowed; returns whether it moved."""
+        with self._connect() as db:
+            placeholders = ", ".join("?" * len(allowed))
+            return db.execute(f"UPDATE jobs SET status = ? WHERE id = ? AND status IN ({placeholders})",
+                              (status, job_id, *allowed)).rowcount > 0
 
-        email_count = 0
-        for entry in data:
-            if 'Email' in entry:
-                email_count += 1
+    def next_due(self):
+        """Returns the highest-priority job that is due, oldest schedule first, or None."""
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        with self._connect() as db:
+            job = db.execute("SELECT * FROM jobs WHERE status IN ('queued', 'running') AND scheduled_at <= ? "
+                             "ORDER BY priority DESC, scheduled_at, id LIMIT 1", (now,)).fetchone()
+        return dict(job, attachments=json.loads(job['attachments'])) if job else None
 
-        return email_count
-    except:
-        return 0
+    def seconds_to_next(self):
+        """Returns the seconds until the next scheduled job is due, or None when nothing is queued."""
+        with self._connect() as db:
+            scheduled = db.execute("SELECT MIN(scheduled_at) FROM jobs WHERE status IN ('queued', 'running')").fetchone()[0]
+        if scheduled is None:
+            return None
+        return max(0.0, (datetime.strptime(scheduled, '%Y-%m-%d %H:%M:%S') - datetime.now()).total_seconds())
 
-def get_current_user():
-    """Get the current logged-in user."""
-    try:
-        with open(CREDENTIALS_FILE, 'r') as file:
-            for line in file:
-                if '@' in line and '.' in line.split('@')[-1]:
-                    email = line.strip().split(':')[0]
-                    return email
-    except FileNotFoundError:
-        pass
+    def take(self, job_id, limit=JOB_BATCH):
+        """Returns the next limit unsent (row, entry) pairs of a job."""
+        with self._connect() as db:
+            return [(row, json.loads(entry)) for row, entry in db.execute(
+                "SELECT row, entry FROM job_recipients WHERE job_id = ? AND state = 0 ORDER BY row LIMIT ?",
+                (job_id, limit))]
+
+    def record(self, job_id, outcomes):
+        """Stores the (row, state) outcomes of a batch; a running job with nothing left to send is completed."""
+        with self._connect() as db:
+            db.executemany("UPDATE job_recipients SET state = ? WHERE job_id = ? AND row = ?",
+                           [(state, job_id, row) for row, state in outcomes if state != JOB_PENDING])
+            db.execute("UPDATE jobs SET sent = sent + ?, failed = failed + ? WHERE id = ?",
+                       (sum(state == JOB_SENT for _, state in outcomes),
+                        sum(state == JOB_FAILED for _, state in outcomes), job_id))
+            if db.execute("SELECT 1 FROM job_recipients WHERE job_id = ? AND state = 0 LIMIT 1",
+                          (job_id,)).fetchone() is None:
+                db.execute("UPDATE jobs SET status = 'completed' WHERE id = ? AND status = 'running'", (job_id,))
+
+    def reschedule(self, job_id, scheduled_at):
+        with self._connect() as db:
+            db.execute("UPDATE jobs SET scheduled_at = ? WHERE id = ?", (scheduled_at, job_id))
+
+    def fail(self, job_id, error):
+        with self._connect() as db:
+            db.execute("UPDATE jobs SET status = 'error', error = ? WHERE id = ?", (error, job_id))
+
+class JobBatch:
+    """Stands in for the campaign journal while a send engine works through one batch of a job."""
+
+    def __init__(self, job_id):
+        self.campaign_id = f"job-{job_id}"
+        self.outcomes = []
+        self.failed = 0
+        self.held = 0
+        self._lock = threading.Lock()
+
+    def is_delivered(self, index):
+        return False
+
+    def record(self, index, success, error_class=None):
+        with self._lock:
+            if success:
+                self.outcomes.append((index, JOB_SENT))
+            elif error_class == 'daily_limit':
+                # Held back by the daily quota: the recipient stays queued for tomorrow
+                self.outcomes.append((index, JOB_PENDING))
+                self.held += 1
+            else:
+                self.outcomes.append((index, JOB_FAILED))
+                self.failed += 1
+
+class JobScheduler:
+    """Background loop that sends due jobs JOB_BATCH recipients at a time, re-picking by priority after each batch.
+
+    While it has work the scheduler holds email_progress, so the dashboard shows queued jobs like a campaign
+    and refuses to start another send until the due jobs are done.
+    """
+
+    def __init__(self, jobs):
+        self.jobs = jobs
+        self._wake = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, daemon=True)
+                    self._thread.start()
+
+    def wake(self):
+        """Makes the loop look at the queue now instead of at its next poll."""
+        self._wake.set()
+
+    def _sleep(self, seconds):
+        self._wake.wait(seconds)
+        self._wake.clear()
+
+    def _run(self):
+        seen = set()
+        while True:
+            try:
+                job = self.jobs.next_due()
+            except sqlite3.Error:
+                job = None
+            if job is None:
+                if seen:
+                    email_progress.update(status='completed')
+                    seen.clear()
+                try:
+                    wait = self.jobs.seconds_to_next()
+                except sqlite3.Error:
+                    wait = None
+                self._sleep(JOB_POLL_INTERVAL if wait is None else min(wait, JOB_POLL_INTERVAL))
+                continue
+            if not seen:
+                # A campaign started from the dashboard has the progress tracker; wait for it to finish
+                if not email_progress.begin():
+                    self._sleep(JOB_POLL_INTERVAL)
+                    continue
+                sender_accounts.reset_health()
+            if job['id'] not in seen:
+                seen.add(job['id'])
+                email_progress.update(total=email_progress.total + job['total'] - job['sent'] - job['failed'],
+                                      status='sending', engine=job['engine'], workers=job['workers'])
+            try:
+                self.send_batch(job)
+            except Exception as e:
+                # E.g. a locked database while storing the outcomes; fail the job and keep the loop alive
+                try:
+                    self.jobs.fail(job['id'], f"Error sending job: {e}")
+                except sqlite3.Error:
+                    pass
+                self._sleep(JOB_POLL_INTERVAL)
+
+    def send_batch(self, job):
+        """Sends the next batch of job with its engine and stores the outcomes."""
+        job_id = job['id']
+        if job['status'] == 'queued':
+            self.jobs.set_status(job_id, 'running', ('queued',))
+        accounts = sender_accounts.load()
+        if not accounts:
+            self.jobs.fail(job_id, "No credentials found. Please add your account first.")
+            return
+        try:
+            compiled = CompiledTemplate(job['template'].splitlines(keepends=True))
+            attachments = [get_attachment_part(os.path.join(FILES_DIRECTORY, name)) for name in job['attachments']]
+        except Exception as e:
+            self.jobs.fail(job_id, f"Error preparing job: {e}")
+            return
+
+        batch = JobBatch(job_id)
+        run = send_async if job['engine'] == 'asyncio' else send_threaded
+        try:
+            run(iter(self.jobs.take(job_id)), accounts, compiled, attachments, batch, job['workers'])
+        except Exception as e:
+            self.jobs.record(job_id, batch.outcomes)
+            self.jobs.fail(job_id, f"Error sending job: {e}")
+            return
+        self.jobs.record(job_id, batch.outcomes)
+        if batch.held:
+            # Every account's daily quota is spent; pick the job up again once it resets
+            self.jobs.reschedule(job_id, (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%d 00:00:00'))
+        log_writer.flush()
+        sender_accounts.save_counts(force=True)
+
+job_queue = JobQueue()
+job_scheduler = JobScheduler(job_queue)
+
+def column_letter(column):
+    """Converts a 1-based column number to its A1 letter (1 -> A, 27 -> AA)."""
+    letters = ""
+    while column > 0:
+        column, remainder = divmod(column - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+def iter_sheet_pages(sheet, columns, page_size=SCAN_PAGE_SIZE, first_row=2):
+    """Yields (first_row, rows) pages holding only the given columns, fetched one row range at a time."""
+    letters = [column_letter(column) for column in columns]
+    last_row = sheet.row_count
+    blank = ("",) * len(columns)
+    start = first_row
+    while start <= last_row:
+        end = min(start + page_size - 1, last_row)
+        with metrics.time('sheet_fetch'):
+            value_ranges = sheet.batch_get([f"{letter}{start}:{letter}{end}" for letter in letters])
+        # Empty trailing cells and rows are omitted by the API, so pad every column to the page length
+        values = [[cells[0] if cells else "" for cells in value_range] for value_range in value_ranges]
+        values = [column + [""] * (end - start + 1 - len(column)) for column in values]
+        rows = list(zip(*values))
+        yield start, rows
+        start = end + 1
+        if any(any(row) for row in rows):
+            continue
+        # A whole page of blank rows is usually the end of the data, but rows may follow a gap
+        resume = find_sheet_data(sheet, letters, start, last_row)
+        if resume is None:
+            return
+        # Pass the gap on as blank rows so row numbers stay aligned for the caller
+        while start < resume:
+            end = min(start + page_size - 1, resume - 1)
+            yield start, [blank] * (end - start + 1)
+            start = end + 1
+
+def find_sheet_data(sheet, letters, first_row, last_row):
+    """Returns the first row from first_row on with data in any of the columns, or None.
+
+    The sheet is probed SCAN_GAP_PROBE_ROWS rows at a time; the API leaves out trailing blank cells, so a probe
+    of a blank window comes back empty however large it is.
+    """
+    for start in range(first_row, last_row + 1, SCAN_GAP_PROBE_ROWS):
+        end = min(start + SCAN_GAP_PROBE_ROWS - 1, last_row)
+        with metrics.time('sheet_fetch'):
+            value_ranges = sheet.batch_get([f"{letter}{start}:{letter}{end}" for letter in letters])
+        offsets = [next(offset for offset, cells in enumerate(value_range) if cells)
+                   for value_range in value_ranges if any(value_range)]
+        if offsets:
+            return start + min(offsets)
     return None
 
-def load_credentials(filename=CREDENTIALS_FILE):
-    """Loads the username and password from a file."""
+def row_hash(last_name, email):
+    """Returns the content hash of one sheet row, as stored in the scan state."""
+    return zlib.crc32(f"{last_name}\x1f{email}".encode('utf-8'))
+
+BLANK_ROW_HASH = row_hash("", "")
+
+def trim_blank_rows(hashes):
+    """Drops the hashes of trailing blank rows, which are page padding rather than data."""
+    while hashes and hashes[-1] == BLANK_ROW_HASH:
+        hashes.pop()
+
+def make_entry(row, last_name, email):
+    """Returns the recipient entry for a sheet row, or None if it has no valid email."""
+    # Only add entries with valid emails
+    email = email.strip()
+    if email and '@' in email:
+        return {"Last_Name": last_name, "Email": email, "Row": row}
+    return None
+
+def scan_store_key(header):
+    """Identifies the recipient store a scan left behind, so a later scan can tell whether it still holds that sheet."""
+    return [header['rows'], header['checksum']] if header else None
+
+def load_scan_state(gid, header):
+    """Returns the saved state of the last scan of a sheet, or None unless the store described by header came from it."""
     try:
-        with open(filename, "r") as file:
-            line = file.readline()
-            username, password = line.strip().split(":")
-            return username, password
-    except (FileNotFoundError, IOError):
+        with open(SCAN_STATE_FILE, 'r', encoding='utf-8') as f:
+            state = json.load(f).get(gid)
+    except (OSError, ValueError):
+        return None
+    if not state or state.get('columns') != [NAME_COLUMN, EMAIL_COLUMN]:
+        return None
+    if header is None or state.get('store') != scan_store_key(header):
+        # The store has since been replaced, e.g. by a scan of another sheet; merging into it would mix the two
         return None
+    hashes = array('I')
+    hashes.frombytes(base64.b64decode(state['hashes']))
+    return hashes
 
-def send_personalized_email(receiver, last_name, template_file=EMAIL_TEMPLATE_FILE, attachment_paths=[]):
-    """Sends a personalized email with an optional attachment."""
-    credentials = load_credentials()
-    if not credentials:
-        return False, "No credentials found. Please add your account first."
+def save_scan_state(gid, hashes, header):
+    """Remembers the per-row hashes of a sheet and the store they were merged into, so the next scan can be incremental."""
+    try:
+        with open(SCAN_STATE_FILE, 'r', encoding='utf-8') as f:
+            states = json.load(f)
+    except (OSError, ValueError):
+        states = {}
+    states[gid] = {
+        'columns': [NAME_COLUMN, EMAIL_COLUMN],
+        'store': scan_store_key(header),
+        'hashes': base64.b64encode(hashes.tobytes()).decode('ascii'),
+    }
+    with open(SCAN_STATE_FILE + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(states, f)
+    os.replace(SCAN_STATE_FILE + ".tmp", SCAN_STATE_FILE)
 
-    sender, password = credentials
+def normalize_email(email):
+    """Returns the form of an address used to compare it: trimmed and lower-cased."""
+    return email.strip().lower()
 
-    try:
-        with open(template_file, "r", encoding='utf-8') as f:
-            lines = f.readlines()
-            if len(lines) > 1:
-                lines[1] = lines[1].replace("name", last_name)  # Replace "name" on the second line
-            subject = lines[0].strip() if lines else "No Subject"
-            message_body = "".join(lines[1:]) if len(lines) > 1 else "".join(lines)
-    except Exception as e:
-        return False, f"Error reading template file: {e}"
+def email_key(email):
+    """Returns a 64-bit hash of a normalized address."""
+    return int.from_bytes(hashlib.blake2b(normalize_email(email).encode('utf-8'), digest_size=8).digest(), 'big')
 
-    # Create MIMEMultipart message
-    message = MIMEMultipart()
-    message["Subject"] = subject
-    message["From"] = sender
-    message["To"] = receiver
+class BloomFilter:
+    """Fixed-size set membership filter for deduplicating addresses in bounded memory."""
 
-    # Attach message body
-    message.attach(MIMEText(message_body, _charset="utf-8"))
+    def __init__(self, capacity, bits_per_entry=DEDUP_BITS_PER_ENTRY, hashes=DEDUP_HASHES):
+        self.size = max(64, capacity * bits_per_entry)
+        self.hashes = hashes
+        self.bits = bytearray((self.size + 7) // 8)
 
-    # Attach files if provided
-    if attachment_paths:
-        for attachment_path in attachment_paths:
-            try:
-                with open(attachment_path, 'rb') as attachment:
-                    part = MIMEBase('application', 'octet-stream')
-                    part.set_payload(attachment.read())
+    def add(self, email):
+        """Adds an address; returns True if it was (very probably) already present."""
+        digest = hashlib.blake2b(normalize_email(email).encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:], 'big') | 1
+        present = True
+        for i in range(self.hashes):
+            position = (h1 + i * h2) % self.size
+            mask = 1 << (position & 7)
+            if not self.bits[position >> 3] & mask:
+                present = False
+                self.bits[position >> 3] |= mask
+        return present
 
-                    encoders.encode_base64(part)
-                    part.add_header('Content-Disposition', 'attachment', filename=os.path.basename(attachment_path))
-                    message.attach(part)
-            except Exception as e:
-                return False, f"Error attaching file {attachment_path}: {e}"
+class SuppressionIndex:
+    """Memory-mapped sorted index of suppressed address hashes, searched by bisection."""
 
-    # Send email with error handling and log successful sends
-    try:
-        with smtplib.SMTP("smtp.gmail.com", 587) as server:
-            server.starttls()
-            server.login(sender, password)
-            server.sendmail(sender, receiver, message.as_string())
-            
-            # Log the successful send to logs.txt
-            with open("logs.txt", "a", encoding='utf-8') as log_file:
-                log_file.write(f"{receiver} > done > {datetime.now().strftime('%Y-%m-%d %H:%M:%S %p')}\n")
-            
-            return True, f"Message sent successfully to: {receiver}"
-    except Exception as e:
-        return False, f"Error sending email to {receiver}: {e}"
+    def __init__(self, list_path=SUPPRESSION_FILE, index_path=SUPPRESSION_INDEX_FILE):
+        self._map = None
+        self.count = 0
+        if not os.path.exists(list_path):
+            return
+        if not os.path.exists(index_path) or os.path.getmtime(index_path) < os.path.getmtime(list_path):
+            build_suppression_index(list_path, index_path)
+        self.count = os.path.getsize(index_path) // 8
+        if self.count:
+            with open(index_path, 'rb') as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
 
-def send_emails_thread():
-    """Send emails in a separate thread to avoid blocking the web interface."""
-    global email_progress
-    
+    def __contains__(self, email):
+        if not self.count:
+            return False
+        key = email_key(email)
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            value = struct.unpack_from('>Q', self._map, mid * 8)[0]
+            if value < key:
+                lo = mid + 1
+            elif value > key:
+                hi = mid
+            else:
+                return True
+        return False
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+
+def build_suppression_index(list_path=SUPPRESSION_FILE, index_path=SUPPRESSION_INDEX_FILE):
+    """Builds the sorted hash index of a suppression list with a chunked external sort."""
+    runs = []
     try:
-        with open(EXTRACTED_DATA_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-    except Exception as e:
-        email_progress['status'] = 'error'
-        email_progress['results'].append({"success": False, "message": f"No data found: {e}"})
-        return
-    
-    attachment_paths = [os.path.join(FILES_DIRECTORY, file) for file in get_attachment_files()]
-    
-    email_progress['total'] = len(data)
-    email_progress['current'] = 0
-    email_progress['status'] = 'sending'
-    email_progress['results'] = []
-    
-    for i, entry in enumerate(data):
-        if 'Email' not in entry:
-            email_progress['results'].append({"success": False, "message": f"Missing email address for entry: {entry}"})
-            email_progress['current'] = i + 1
-            continue
-            
-        receiver = entry['Email']
-        last_name = entry.get("Last_Name", "Valued Customer")
-        
-        success, message = send_personalized_email(receiver, last_name, EMAIL_TEMPLATE_FILE, attachment_paths)
-        email_progress['results'].append({"success": success, "message": message})
-        email_progress['current'] = i + 1
-        
-        # Small delay to avoid hitting rate limits
-        time.sleep(0.5)
-    
-    email_progress['status'] = 'completed'
+        with open(list_path, 'r', encoding='utf-8', errors='replace') as f:
+            while True:
+                chunk = sorted({email_key(line) for line in (f.readline() for _ in range(SUPPRESSION_SORT_CHUNK)) if line.strip()})
+                if not chunk:
+                    break
+                run = tempfile.TemporaryFile()
+                run.write(array('Q', chunk).tobytes())
+                run.seek(0)
+                runs.append(run)
+        with open(index_path + ".tmp", 'wb') as out:
+            last = None
+            for key in heapq.merge(*[iter_run(run) for run in runs]):
+                if key != last:
+                    out.write(struct.pack('>Q', key))
+                    last = key
+        os.replace(index_path + ".tmp", index_path)
+    finally:
+        for run in runs:
+            run.close()
+
+def iter_run(run, block=65536):
+    """Yields the hashes of one sorted run file."""
+    while True:
+        data = run.read(block * 8)
+        if not data:
+            return
+        keys = array('Q')
+        keys.frombytes(data)
+        yield from keys
+
+class RecipientFilter:
+    """Ingest stage that drops duplicate and suppressed addresses, counting what it dropped."""
+
+    def __init__(self, capacity):
+        self.seen = BloomFilter(capacity)
+        self.suppressed = SuppressionIndex()
+        self.duplicates = 0
+        self.suppressions = 0
+
+    def accept(self, entry):
+        """Returns True if the entry should be kept."""
+        email = entry['Email']
+        if email in self.suppressed:
+            self.suppressions += 1
+            return False
+        if self.seen.add(email):
+            self.duplicates += 1
+            return False
+        return True
+
+    def summary(self):
+        return f"{self.duplicates} duplicates and {self.suppressions} suppressed addresses dropped."
+
+    def close(self):
+        self.suppressed.close()
 
-def scan_data(floc, gid):
-    """Scan data from Google Sheets and save to JSON."""
+def scan_worksheet(sheet, name_column=NAME_COLUMN, email_column=EMAIL_COLUMN, page_size=SCAN_PAGE_SIZE, hashes=None,
+                   recipient_filter=None):
+    """Streams the name and email columns of a worksheet into the recipient store, page by page."""
+    scan_progress['total'] = max(0, sheet.row_count - 1)
+    scan_progress['current'] = 0
+    if recipient_filter is None:
+        recipient_filter = RecipientFilter(sheet.row_count)
+    with RecipientStoreWriter(RECIPIENTS_FILE) as writer:
+        # Skip the header row (assuming the first row contains column names)
+        for start, rows in iter_sheet_pages(sheet, (name_column, email_column), page_size):
+            with metrics.time('scan_page'):
+                for row, (last_name, email) in enumerate(rows, start):
+                    if hashes is not None:
+                        hashes.append(row_hash(last_name, email))
+                    entry = make_entry(row, last_name, email)
+                    if entry and recipient_filter.accept(entry):
+                        writer.append(entry)
+            scan_progress['current'] = start - 1 + len(rows)
+            scan_progress['message'] = f"{writer.rows} entries extracted so far."
+    if hashes is not None:
+        trim_blank_rows(hashes)
+    scan_progress['current'] = scan_progress['total']
+    return writer.rows
+
+def scan_worksheet_incremental(sheet, old_hashes, hashes, name_column=NAME_COLUMN, email_column=EMAIL_COLUMN,
+                               page_size=SCAN_VERIFY_PAGE_SIZE, recipient_filter=None):
+    """Merges only new or changed sheet rows into the recipient store; returns added/updated/removed counts."""
+    if recipient_filter is None:
+        recipient_filter = RecipientFilter(sheet.row_count)
+    scan_progress['total'] = max(0, sheet.row_count - 1)
+    scan_progress['current'] = 0
+    changed = {}  # Known rows whose content changed: row -> new entry, or None if no longer valid
+    appended = []
+    for start, rows in iter_sheet_pages(sheet, (name_column, email_column), page_size):
+        with metrics.time('scan_page'):
+            for row, (last_name, email) in enumerate(rows, start):
+                digest = row_hash(last_name, email)
+                hashes.append(digest)
+                index = row - 2
+                if index < len(old_hashes):
+                    if old_hashes[index] != digest:
+                        changed[row] = make_entry(row, last_name, email)
+                else:
+                    entry = make_entry(row, last_name, email)
+                    if entry:
+                        appended.append(entry)
+        scan_progress['current'] = start - 1 + len(rows)
+        scan_progress['message'] = f"{len(changed)} changed and {len(appended)} new rows found so far."
+    trim_blank_rows(hashes)
+    # Rows the sheet no longer has
+    for row in range(len(hashes) + 2, len(old_hashes) + 2):
+        changed[row] = None
+
+    # Seed the duplicate filter with the rows that stay as they are
+    for entry in iter_recipients(RECIPIENTS_FILE):
+        if entry.get('Row') not in changed:
+            recipient_filter.seen.add(entry['Email'])
+
+    summary = {'added': 0, 'updated': 0, 'removed': 0}
+    if not changed:
+        # Only the tail grew, so append without rewriting the store
+        with RecipientStoreWriter(RECIPIENTS_FILE, append=True) as writer:
+            for entry in appended:
+                if recipient_filter.accept(entry):
+                    writer.append(entry)
+                    summary['added'] += 1
+    else:
+        with RecipientStoreWriter(RECIPIENTS_FILE) as writer:
+            for entry in iter_recipients(RECIPIENTS_FILE):
+                row = entry.get('Row')
+                if row in changed:
+                    entry = changed.pop(row)
+                    if entry and not recipient_filter.accept(entry):
+                        entry = None
+                    summary['updated' if entry else 'removed'] += 1
+                if entry:
+                    writer.append(entry)
+            # Changed rows that were not in the store before, e.g. an invalid email that was fixed
+            for entry in list(changed.values()) + appended:
+                if entry and recipient_filter.accept(entry):
+                    writer.append(entry)
+                    summary['added'] += 1
+    scan_progress['current'] = scan_progress['total']
+    summary['total'] = count_emails(RECIPIENTS_FILE)
+    return summary
+
+def scan_data(floc, gid, incremental=False):
+    """Scan data from Google Sheets into the recipient store, optionally merging only new or changed rows."""
+    scan_progress['status'] = 'scanning'
+    scan_progress['message'] = 'Connecting to Google Sheets...'
     try:
+        # The Google client libraries are slow to import, so only scans pay for them
+        import gspread
+        from oauth2client.service_account import ServiceAccountCredentials
+
         # Replace with the path to your service account key JSON file 
         SCOPES = ['https://www.googleapis.com/auth/spreadsheets.readonly']
         creds = ServiceAccountCredentials.from_json_keyfile_name(floc, SCOPES)
@@ -176,32 +3201,28 @@ def scan_data(floc, gid):
         # Open the sheet by ID
         sheet = client.open_by_key(gid).sheet1
 
-        # Get all data from the sheet
-        data = sheet.get_all_values()
-
-        # Assuming Last Name and Email are in columns with known positions
-        last_name_column = 2  # Adjust this based on your actual column position
-        email_column = 5  # Adjust this based on your actual column position
-
-        # Create an empty list to store extracted data
-        extracted_data = []
-
-        # Skip the header row (assuming the first row contains column names)
-        for row in data[1:]:
-            if len(row) >= max(last_name_column, email_column):
-                last_name = row[last_name_column - 1]
-                email = row[email_column - 1]
-                # Only add entries with valid emails
-                if email and '@' in email:
-                    entry = {"Last_Name": last_name, "Email": email}
-                    extracted_data.append(entry)
-
-        # Write the extracted data to a JSON file
-        with open(EXTRACTED_DATA_FILE, 'w', encoding='utf-8') as outfile:
-            json.dump(extracted_data, outfile, indent=4)
-
-        return True, f"Scan Completed! {len(extracted_data)} entries extracted."
+        hashes = array('I')
+        old_hashes = (load_scan_state(gid, read_recipient_header(RECIPIENTS_FILE))
+                      if incremental and os.path.exists(RECIPIENTS_FILE) else None)
+        recipient_filter = RecipientFilter(sheet.row_count + count_emails(RECIPIENTS_FILE))
+        try:
+            if old_hashes is not None:
+                summary = scan_worksheet_incremental(sheet, old_hashes, hashes, recipient_filter=recipient_filter)
+                message = (f"Incremental Scan Completed! {summary['added']} added, {summary['updated']} updated, "
+                           f"{summary['removed']} removed, {summary['total']} entries in total.")
+            else:
+                count = scan_worksheet(sheet, hashes=hashes, recipient_filter=recipient_filter)
+                message = f"Scan Completed! {count} entries extracted."
+        finally:
+            recipient_filter.close()
+        message += " " + recipient_filter.summary()
+        save_scan_state(gid, hashes, read_recipient_header(RECIPIENTS_FILE))
+        scan_progress['status'] = 'completed'
+        scan_progress['message'] = message
+        return True, message
     except Exception as e:
+        scan_progress['status'] = 'error'
+        scan_progress['message'] = f"Error during scan: {e}"
         return False, f"Error during scan: {e}"
 
 def get_attachment_files():
@@ -215,8 +3236,51 @@ def get_attachment_files():
     except:
         return []
 
+class MetadataCache:
+    """Caches values derived from a file or directory, keyed on its mtime and size."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, path, loader):
+        """Returns the cached value for key, calling loader() when path changed since it was cached."""
+        try:
+            stat = os.stat(path)
+            signature = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            signature = None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == signature:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        value = loader()
+        with self._lock:
+            self._entries[key] = (signature, value)
+        return value
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries)}
+
+# Dashboard values: recipient count, current user and attachment list
+dashboard_cache = MetadataCache()
+
 def create_default_template():
     """Create a default email template if it doesn't exist."""
+    if os.path.exists(EMAIL_TEMPLATE_FILE):
+        return
     default_template = """Welcome to Our Service!
 
 Dear name,
@@ -229,15 +3293,13 @@ Best regards,
 The Support Team"""
     
     try:
+        os.makedirs(os.path.dirname(EMAIL_TEMPLATE_FILE), exist_ok=True)
         with open(EMAIL_TEMPLATE_FILE, 'w', encoding='utf-8') as f:
             f.write(default_template)
     except:
         pass
 
-# Create default template on startup
-create_default_template()
-
-# HTML Templates as string variables that will be written to files
+# HTML Templates as string variables, served from memory by the Jinja loader
 BASE_HTML = '''<!DOCTYPE html>
 <html lang="en">
 <head>
@@ -296,6 +3358,9 @@ BASE_HTML = '''<!DOCTYPE html>
                     <li class="nav-item">
                         <a class="nav-link" href="{{ url_for('account') }}">Account</a>
                     </li>
+                    <li class="nav-item">
+                        <a class="nav-link" href="{{ url_for('jobs') }}">Jobs</a>
+                    </li>
                     <li class="nav-item">
                         <a class="nav-link" href="{{ url_for('logs') }}">Logs</a>
                     </li>
@@ -349,6 +3414,28 @@ INDEX_HTML = '''{% extends "base.html" %}
                     </div>
                 </div>
                 
+                <div class="input-group mb-3">
+                    <span class="input-group-text"><i class="bi bi-diagram-3"></i>&nbsp;Concurrent Workers</span>
+                    <input type="number" class="form-control" id="workersInput" min="1" max="{{ max_workers }}" value="{{ default_workers }}">
+                    <select class="form-select" id="engineSelect" data-max-threads="{{ max_workers }}" data-max-async="{{ max_async_sessions }}">
+                        <option value="threads" {{ "selected" if default_engine == "threads" else "" }}>Threads</option>
+                        <option value="asyncio" {{ "selected" if default_engine == "asyncio" else "" }}>Asyncio (high concurrency)</option>
+                        <option value="processes" {{ "selected" if default_engine == "processes" else "" }}>Processes (workers per core)</option>
+                        <option value="spool" {{ "selected" if default_engine == "spool" else "" }}>Spool (render ahead, then deliver)</option>
+                    </select>
+                </div>
+                
+                <div class="input-group mb-1">
+                    <span class="input-group-text"><i class="bi bi-people"></i>&nbsp;Recipients per Message</span>
+                    <input type="number" class="form-control" id="batchInput" min="1" max="{{ max_batch }}" value="{{ default_batch }}">
+                </div>
+                <div class="form-text mb-3">Above 1, recipients who would get an identical email share one message addressed to undisclosed recipients.</div>
+                
+                <div class="form-check mb-3">
+                    <input class="form-check-input" type="checkbox" id="profileCheck">
+                    <label class="form-check-label" for="profileCheck">Profile this campaign (writes a stack sample file)</label>
+                </div>
+                
                 <div class="d-grid gap-2">
                     <button id="sendEmailsBtn" class="btn btn-primary btn-lg action-btn" {{ "disabled" if total_emails == 0 else "" }}>
                         <i class="bi bi-send"></i> Start Sending Emails
@@ -439,6 +3526,12 @@ INDEX_HTML = '''{% extends "base.html" %}
 
 {% block scripts %}
 <script>
+document.getElementById('engineSelect').addEventListener('change', function() {
+    // Asyncio sessions are cheap, so that engine allows far more of them than threads
+    const limit = this.value === 'asyncio' ? this.dataset.maxAsync : this.dataset.maxThreads;
+    document.getElementById('workersInput').max = limit;
+});
+
 document.getElementById('sendEmailsBtn').addEventListener('click', function() {
     const modal = new bootstrap.Modal(document.getElementById('progressModal'));
     modal.show();
@@ -453,51 +3546,91 @@ document.getElementById('sendEmailsBtn').addEventListener('click', function() {
         method: 'POST',
         headers: {
             'Content-Type': 'application/json',
-        }
+        },
+        body: JSON.stringify({
+            workers: parseInt(document.getElementById('workersInput').value, 10),
+            batch: parseInt(document.getElementById('batchInput').value, 10),
+            engine: document.getElementById('engineSelect').value,
+            profile: document.getElementById('profileCheck').checked
+        })
     })
     .then(response => response.json())
     .then(data => {
         if (data.success) {
-            // Start polling for progress
-            const progressInterval = setInterval(() => {
-                fetch('{{ url_for("get_progress") }}')
-                .then(response => response.json())
-                .then(progressData => {
-                    const percent = progressData.total > 0 ? Math.round((progressData.current / progressData.total) * 100) : 0;
-                    progressBar.style.width = percent + '%';
-                    progressBar.textContent = percent + '%';
-                    
-                    // Update progress details
-                    let detailsHtml = '';
-                    if (progressData.status === 'sending') {
-                        detailsHtml = `<p>Sending ${progressData.current} of ${progressData.total} emails...</p>`;
-                    } else if (progressData.status === 'completed') {
-                        detailsHtml = `<div class="alert alert-success">Email sending completed!</div>`;
-                        clearInterval(progressInterval);
-                    } else if (progressData.status === 'error') {
-                        detailsHtml = `<div class="alert alert-danger">Error occurred during sending.</div>`;
-                        clearInterval(progressInterval);
-                    }
-                    
-                    // Add recent results
-                    if (progressData.results && progressData.results.length > 0) {
-                        const recentResults = progressData.results.slice(-10); // Show last 10 results
-                        recentResults.forEach(result => {
-                            const alertClass = result.success ? 'alert-success' : 'alert-danger';
-                            detailsHtml += `<div class="alert ${alertClass} py-2">${result.message}</div>`;
-                        });
+            let cursor = 0;
+            const recentResults = []; // Show last 10 results
+            
+            const render = progressData => {
+                cursor = progressData.cursor;
+                progressData.results.forEach(result => {
+                    recentResults.push(result);
+                    if (recentResults.length > 10) {
+                        recentResults.shift();
                     }
-                    
-                    progressDetails.innerHTML = detailsHtml;
-                    
-                    // Scroll to bottom
-                    progressDetails.scrollTop = progressDetails.scrollHeight;
-                    
-                    if (progressData.status === 'completed' || progressData.status === 'error') {
-                        clearInterval(progressInterval);
+                });
+                
+                const percent = progressData.total > 0 ? Math.round((progressData.current / progressData.total) * 100) : 0;
+                progressBar.style.width = percent + '%';
+                progressBar.textContent = percent + '%';
+                
+                // Update progress details
+                let detailsHtml = '';
+                if (progressData.status === 'starting') {
+                    detailsHtml = '<p>Starting email sending process...</p>';
+                } else if (progressData.status === 'sending') {
+                    detailsHtml = `<p>Sending ${progressData.current} of ${progressData.total} emails...</p>`;
+                    if (progressData.resumed) {
+                        detailsHtml += `<p class="text-muted small">Resumed: ${progressData.resumed} already delivered before the last restart.</p>`;
                     }
+                    detailsHtml += `<p class="text-muted small">Rate: ${progressData.rate} msg/s &middot; Daily quota left: ${progressData.daily_remaining}</p>`;
+                }
+                if (progressData.status === 'sending' || progressData.status === 'completed') {
+                    const failures = Object.entries(progressData.failures).map(([name, count]) => `${name}: ${count}`).join(', ');
+                    detailsHtml += `<p class="text-muted small">Sent: ${progressData.sent} &middot; Failed: ${progressData.failed}${failures ? ' (' + failures + ')' : ''} &middot; Skipped: ${progressData.skipped}</p>`;
+                }
+                if (progressData.status === 'completed') {
+                    detailsHtml += `<div class="alert alert-success">Email sending completed!</div>`;
+                } else if (progressData.status === 'error') {
+                    detailsHtml += `<div class="alert alert-danger">Error occurred during sending.</div>`;
+                }
+                if (progressData.profile) {
+                    detailsHtml += `<p class="text-muted small">Profile written to ${progressData.profile}</p>`;
+                }
+                
+                // Add recent results
+                recentResults.forEach(result => {
+                    const alertClass = result.success ? 'alert-success' : 'alert-danger';
+                    detailsHtml += `<div class="alert ${alertClass} py-2">${result.message}</div>`;
                 });
-            }, 1000);
+                
+                progressDetails.innerHTML = detailsHtml;
+                
+                // Scroll to bottom
+                progressDetails.scrollTop = progressDetails.scrollHeight;
+                
+                return progressData.status === 'completed' || progressData.status === 'error';
+            };
+            
+            if (window.EventSource) {
+                // The server pushes counters and new results as they happen
+                const source = new EventSource('{{ url_for("progress_stream") }}?cursor=0');
+                source.onmessage = event => {
+                    if (render(JSON.parse(event.data))) {
+                        source.close();
+                    }
+                };
+            } else {
+                // Fall back to polling, asking only for results after the cursor
+                const progressInterval = setInterval(() => {
+                    fetch(`{{ url_for("get_progress") }}?cursor=${cursor}`)
+                    .then(response => response.json())
+                    .then(progressData => {
+                        if (render(progressData)) {
+                            clearInterval(progressInterval);
+                        }
+                    });
+                }, 1000);
+            }
         } else {
             progressBar.style.width = '100%';
             progressBar.textContent = '100%';
@@ -544,12 +3677,19 @@ SCAN_HTML = '''{% extends "base.html" %}
                         </div>
                     </div>
                     
+                    <div class="form-check mb-3">
+                        <input class="form-check-input" type="checkbox" id="incremental" name="incremental" checked>
+                        <label class="form-check-label" for="incremental">Incremental scan</label>
+                        <div class="form-text">Only merge rows that are new or changed since the last scan of this sheet.</div>
+                    </div>
+                    
                     <div class="alert alert-info">
                         <h6>Note:</h6>
                         <ul>
                             <li>Last Name is expected in column 2</li>
                             <li>Email is expected in column 5</li>
                             <li>The first row is assumed to be headers and will be skipped</li>
+                            <li>Duplicate addresses and addresses listed in <code>suppression.txt</code> are dropped</li>
                         </ul>
                     </div>
                     
@@ -559,27 +3699,92 @@ SCAN_HTML = '''{% extends "base.html" %}
                         </button>
                     </div>
                 </form>
+                
+                <div id="scanProgress" class="mt-3" style="display: none;">
+                    <div class="progress mb-2">
+                        <div id="scanProgressBar" class="progress-bar" role="progressbar" style="width: 0%">0%</div>
+                    </div>
+                    <p id="scanProgressDetails" class="text-muted mb-0">Starting scan...</p>
+                </div>
             </div>
         </div>
     </div>
 </div>
 {% endblock %}
+
+{% block scripts %}
+<script>
+document.querySelector('form').addEventListener('submit', function() {
+    document.getElementById('scanProgress').style.display = 'block';
+    const progressBar = document.getElementById('scanProgressBar');
+    const progressDetails = document.getElementById('scanProgressDetails');
+    
+    // The form submission blocks until the scan finishes, so poll for progress meanwhile
+    setInterval(() => {
+        fetch('{{ url_for("get_scan_progress") }}')
+        .then(response => response.json())
+        .then(progressData => {
+            const percent = progressData.total > 0 ? Math.round((progressData.current / progressData.total) * 100) : 0;
+            progressBar.style.width = percent + '%';
+            progressBar.textContent = percent + '%';
+            progressDetails.textContent = progressData.message;
+        });
+    }, 1000);
+});
+</script>
+{% endblock %}
 '''
 
 ACCOUNT_HTML = '''{% extends "base.html" %}
 
 {% block content %}
 <div class="row justify-content-center">
-    <div class="col-md-8">
+    <div class="col-md-10">
         <div class="card">
             <div class="card-header">
                 <h4>Account Settings</h4>
             </div>
             <div class="card-body">
-                {% if current_account %}
-                <div class="alert alert-info mb-4">
-                    <h5>Current Account</h5>
-                    <p class="mb-0">Logged in as: <strong>{{ current_account }}</strong></p>
+                {% if accounts %}
+                <div class="table-responsive mb-4">
+                    <table class="table table-sm align-middle">
+                        <thead>
+                            <tr>
+                                <th>Sender</th>
+                                <th>Weight</th>
+                                <th>Quota Left Today</th>
+                                <th>Throughput</th>
+                                <th>Sent / Failed</th>
+                                <th>Health</th>
+                                <th></th>
+                            </tr>
+                        </thead>
+                        <tbody>
+                            {% for account in accounts %}
+                            <tr>
+                                <td><strong>{{ account.username }}</strong></td>
+                                <td>{{ account.weight }}</td>
+                                <td>{{ account.daily_remaining }} / {{ account.daily_limit }}</td>
+                                <td>{{ account.per_minute }}/min <span class="text-muted small">(limit {{ account.rate }}/s)</span></td>
+                                <td>{{ account.sent }} / {{ account.failed }}</td>
+                                <td>
+                                    <span class="badge {{ 'bg-success' if account.health == 'ok' else 'bg-warning text-dark' if account.health in ('cooling down', 'quota used') else 'bg-danger' }}">
+                                        {{ account.health }}
+                                    </span>
+                                </td>
+                                <td>
+                                    <form method="POST" onsubmit="return confirm('Remove {{ account.username }}?');">
+                                        <input type="hidden" name="action" value="remove">
+                                        <input type="hidden" name="username" value="{{ account.username }}">
+                                        <button type="submit" class="btn btn-sm btn-outline-danger">
+                                            <i class="bi bi-trash"></i>
+                                        </button>
+                                    </form>
+                                </td>
+                            </tr>
+                            {% endfor %}
+                        </tbody>
+                    </table>
                 </div>
                 {% else %}
                 <div class="alert alert-warning mb-4">
@@ -588,55 +3793,45 @@ ACCOUNT_HTML = '''{% extends "base.html" %}
                 </div>
                 {% endif %}
                 
-                <div class="row">
-                    <div class="col-md-6">
-                        <div class="card">
-                            <div class="card-header">
-                                <h5>Add/Update Account</h5>
-                            </div>
-                            <div class="card-body">
-                                <form method="POST">
-                                    <input type="hidden" name="action" value="add">
-                                    <div class="mb-3">
-                                        <label for="username" class="form-label">Email Address</label>
-                                        <input type="email" class="form-control" id="username" name="username" 
-                                               placeholder="your.email@gmail.com" required>
-                                    </div>
-                                    <div class="mb-3">
-                                        <label for="password" class="form-label">Password/App Password</label>
-                                        <input type="password" class="form-control" id="password" name="password" 
-                                               placeholder="Your password or app password" required>
-                                        <div class="form-text">
-                                            For Gmail, you may need to use an App Password if 2FA is enabled.
-                                        </div>
+                <div class="card">
+                    <div class="card-header">
+                        <h5>Add/Update Account</h5>
+                    </div>
+                    <div class="card-body">
+                        <form method="POST">
+                            <input type="hidden" name="action" value="add">
+                            <div class="row">
+                                <div class="col-md-6 mb-3">
+                                    <label for="username" class="form-label">Email Address</label>
+                                    <input type="email" class="form-control" id="username" name="username" 
+                                           placeholder="your.email@gmail.com" required>
+                                </div>
+                                <div class="col-md-6 mb-3">
+                                    <label for="password" class="form-label">Password/App Password</label>
+                                    <input type="password" class="form-control" id="password" name="password" 
+                                           placeholder="Your password or app password" required>
+                                    <div class="form-text">
+                                        For Gmail, you may need to use an App Password if 2FA is enabled.
                                     </div>
-                                    <div class="d-grid">
-                                        <button type="submit" class="btn btn-primary">
-                                            <i class="bi bi-save"></i> Save Credentials
-                                        </button>
+                                </div>
+                                <div class="col-md-6 mb-3">
+                                    <label for="quota" class="form-label">Daily Quota</label>
+                                    <input type="number" class="form-control" id="quota" name="quota" min="0" value="{{ default_quota }}">
+                                </div>
+                                <div class="col-md-6 mb-3">
+                                    <label for="weight" class="form-label">Weight</label>
+                                    <input type="number" class="form-control" id="weight" name="weight" min="1" value="1">
+                                    <div class="form-text">
+                                        Accounts get a share of recipients proportional to their weight.
                                     </div>
-                                </form>
-                            </div>
-                        </div>
-                    </div>
-                    
-                    <div class="col-md-6">
-                        <div class="card">
-                            <div class="card-header">
-                                <h5>Remove Account</h5>
+                                </div>
                             </div>
-                            <div class="card-body">
-                                <p>This will remove your saved account credentials.</p>
-                                <form method="POST" onsubmit="return confirm('Are you sure you want to remove your account?');">
-                                    <input type="hidden" name="action" value="remove">
-                                    <div class="d-grid">
-                                        <button type="submit" class="btn btn-danger">
-                                            <i class="bi bi-trash"></i> Remove Account
-                                        </button>
-                                    </div>
-                                </form>
+                            <div class="d-grid">
+                                <button type="submit" class="btn btn-primary">
+                                    <i class="bi bi-save"></i> Save Credentials
+                                </button>
                             </div>
-                        </div>
+                        </form>
                     </div>
                 </div>
             </div>
@@ -661,6 +3856,7 @@ TEMPLATE_HTML = '''{% extends "base.html" %}
                     <ul class="mb-0">
                         <li>The first line will be used as the email subject</li>
                         <li>Use <code>name</code> as a placeholder for the recipient's last name</li>
+                        <li>Use <code>{{ '{{' }}Column_Name{{ '}}' }}</code> anywhere to insert any scanned column, e.g. <code>{{ '{{' }}Email{{ '}}' }}</code></li>
                         <li>The rest of the template will be used as the email body</li>
                     </ul>
                 </div>
@@ -747,13 +3943,63 @@ LOGS_HTML = '''{% extends "base.html" %}
         <div class="card">
             <div class="card-header d-flex justify-content-between align-items-center">
                 <h4>Email Logs</h4>
-                <a href="{{ url_for('logs') }}" class="btn btn-outline-primary btn-sm">
+                <a href="{{ url_for('logs', **filters) }}" class="btn btn-outline-primary btn-sm">
                     <i class="bi bi-arrow-clockwise"></i> Refresh
                 </a>
             </div>
             <div class="card-body">
-                {% if logs_content %}
-                    <pre style="max-height: 500px; overflow-y: auto; background: #f8f9fa; padding: 15px; border-radius: 5px;">{{ logs_content }}</pre>
+                <form method="GET" class="row g-2 mb-3">
+                    <div class="col-md-4">
+                        <input type="text" class="form-control" name="recipient" placeholder="Recipient email" value="{{ filters.recipient }}">
+                    </div>
+                    <div class="col-md-2">
+                        <select class="form-select" name="status">
+                            <option value="">Any status</option>
+                            <option value="done" {{ "selected" if filters.status == "done" else "" }}>Done</option>
+                            <option value="failed" {{ "selected" if filters.status == "failed" else "" }}>Failed</option>
+                        </select>
+                    </div>
+                    <div class="col-md-2">
+                        <input type="date" class="form-control" name="since" value="{{ filters.since }}" title="From">
+                    </div>
+                    <div class="col-md-2">
+                        <input type="date" class="form-control" name="until" value="{{ filters.until }}" title="Until">
+                    </div>
+                    <div class="col-md-2 d-grid">
+                        <button type="submit" class="btn btn-primary"><i class="bi bi-funnel"></i> Filter</button>
+                    </div>
+                </form>
+                
+                {% if entries %}
+                    <div class="table-responsive" style="max-height: 500px; overflow-y: auto;">
+                        <table class="table table-sm table-striped">
+                            <thead>
+                                <tr><th>Time</th><th>Recipient</th><th>Status</th><th>Detail</th></tr>
+                            </thead>
+                            <tbody>
+                                {% for entry in entries %}
+                                <tr>
+                                    <td class="text-nowrap">{{ entry[1] }}</td>
+                                    <td>{{ entry[2] }}</td>
+                                    <td><span class="badge {{ 'bg-success' if entry[3] == 'done' else 'bg-danger' }}">{{ entry[3] }}</span></td>
+                                    <td class="small">{{ entry[4] or "" }}</td>
+                                </tr>
+                                {% endfor %}
+                            </tbody>
+                        </table>
+                    </div>
+                    <div class="d-flex justify-content-between mt-2">
+                        {% if has_newer %}
+                            <a href="{{ url_for('logs', after=entries[0][0], **filters) }}" class="btn btn-outline-secondary btn-sm">
+                                <i class="bi bi-chevron-left"></i> Newer
+                            </a>
+                        {% else %}<span></span>{% endif %}
+                        {% if has_older %}
+                            <a href="{{ url_for('logs', before=entries[-1][0], **filters) }}" class="btn btn-outline-secondary btn-sm">
+                                Older <i class="bi bi-chevron-right"></i>
+                            </a>
+                        {% endif %}
+                    </div>
                 {% else %}
                     <p class="text-muted">No logs available.</p>
                 {% endif %}
@@ -764,57 +4010,216 @@ LOGS_HTML = '''{% extends "base.html" %}
 {% endblock %}
 '''
 
-# Write HTML templates to files
-def create_template_files():
-    templates = {
-        'base.html': BASE_HTML,
-        'index.html': INDEX_HTML,
-        'scan.html': SCAN_HTML,
-        'account.html': ACCOUNT_HTML,
-        'template.html': TEMPLATE_HTML,
-        'attachments.html': ATTACHMENTS_HTML,
-        'logs.html': LOGS_HTML
-    }
-    
-    for filename, content in templates.items():
-        with open(f'templates/{filename}', 'w', encoding='utf-8') as f:
-            f.write(content)
+JOBS_HTML = '''{% extends "base.html" %}
+
+{% block content %}
+<div class="row justify-content-center">
+    <div class="col-md-10">
+        <div class="card">
+            <div class="card-header d-flex justify-content-between align-items-center">
+                <h4>Campaign Jobs</h4>
+                <a href="{{ url_for('jobs') }}" class="btn btn-outline-primary btn-sm">
+                    <i class="bi bi-arrow-clockwise"></i> Refresh
+                </a>
+            </div>
+            <div class="card-body">
+                {% if jobs %}
+                <div class="table-responsive mb-4">
+                    <table class="table table-sm align-middle">
+                        <thead>
+                            <tr>
+                                <th>#</th>
+                                <th>Name</th>
+                                <th>Status</th>
+                                <th>Priority</th>
+                                <th>Scheduled</th>
+                                <th>Sent / Failed / Total</th>
+                                <th>Engine</th>
+                                <th></th>
+                            </tr>
+                        </thead>
+                        <tbody>
+                            {% for job in jobs %}
+                            <tr>
+                                <td>{{ job.id }}</td>
+                                <td><strong>{{ job.name }}</strong>{% if job.error %}<div class="small text-danger">{{ job.error }}</div>{% endif %}</td>
+                                <td>
+                                    <span class="badge {{ 'bg-success' if job.status == 'completed' else 'bg-primary' if job.status == 'running' else 'bg-info text-dark' if job.status == 'queued' else 'bg-warning text-dark' if job.status == 'paused' else 'bg-danger' if job.status == 'error' else 'bg-secondary' }}">
+                                        {{ job.status }}
+                                    </span>
+                                </td>
+                                <td>{{ job.priority }}</td>
+                                <td class="text-nowrap">{{ job.scheduled_at }}</td>
+                                <td>{{ job.sent }} / {{ job.failed }} / {{ job.total }}</td>
+                                <td>{{ job.engine }} &times; {{ job.workers }}</td>
+                                <td class="text-nowrap">
+                                    {% for action, (status, allowed) in actions.items() if job.status in allowed %}
+                                    <form method="POST" action="{{ url_for('job_action', job_id=job.id, action=action) }}" class="d-inline"
+                                          {% if action == 'cancel' %}onsubmit="return confirm('Cancel {{ job.name }}?');"{% endif %}>
+                                        <button type="submit" class="btn btn-sm {{ 'btn-outline-danger' if action == 'cancel' else 'btn-outline-secondary' }}" title="{{ action|capitalize }}">
+                                            <i class="bi {{ 'bi-pause' if action == 'pause' else 'bi-play' if action == 'resume' else 'bi-x-lg' }}"></i>
+                                        </button>
+                                    </form>
+                                    {% endfor %}
+                                </td>
+                            </tr>
+                            {% endfor %}
+                        </tbody>
+                    </table>
+                </div>
+                {% else %}
+                <p class="text-muted">No jobs queued yet.</p>
+                {% endif %}
+                
+                <div class="card">
+                    <div class="card-header">
+                        <h5>Queue a Job</h5>
+                    </div>
+                    <div class="card-body">
+                        <p class="text-muted small">The job sends to the {{ total_emails }} recipients of the last scan, with the template and attachments chosen here.</p>
+                        <form method="POST">
+                            <div class="row">
+                                <div class="col-md-6 mb-3">
+                                    <label for="name" class="form-label">Name</label>
+                                    <input type="text" class="form-control" id="name" name="name" placeholder="Spring newsletter">
+                                </div>
+                                <div class="col-md-3 mb-3">
+                                    <label for="priority" class="form-label">Priority</label>
+                                    <input type="number" class="form-control" id="priority" name="priority" value="0">
+                                    <div class="form-text">Higher runs first.</div>
+                                </div>
+                                <div class="col-md-3 mb-3">
+                                    <label for="scheduled_at" class="form-label">Start At</label>
+                                    <input type="datetime-local" class="form-control" id="scheduled_at" name="scheduled_at">
+                                    <div class="form-text">Empty starts now.</div>
+                                </div>
+                                <div class="col-md-6 mb-3">
+                                    <label for="engine" class="form-label">Engine</label>
+                                    <select class="form-select" id="engine" name="engine">
+                                        {% for engine in engines %}
+                                        <option value="{{ engine }}">{{ engine|capitalize }}</option>
+                                        {% endfor %}
+                                    </select>
+                                </div>
+                                <div class="col-md-6 mb-3">
+                                    <label for="workers" class="form-label">Concurrent Workers</label>
+                                    <input type="number" class="form-control" id="workers" name="workers" min="1" max="{{ max_async_sessions }}" value="{{ default_workers }}">
+                                </div>
+                                <div class="col-12 mb-3">
+                                    <label for="template_content" class="form-label">Template</label>
+                                    <textarea class="form-control" id="template_content" name="template_content" rows="8" required>{{ template_content }}</textarea>
+                                </div>
+                                {% if attachment_files %}
+                                <div class="col-12 mb-3">
+                                    <label class="form-label">Attachments</label>
+                                    {% for file in attachment_files %}
+                                    <div class="form-check">
+                                        <input class="form-check-input" type="checkbox" name="attachments" value="{{ file }}" id="attachment{{ loop.index }}" checked>
+                                        <label class="form-check-label" for="attachment{{ loop.index }}">{{ file }}</label>
+                                    </div>
+                                    {% endfor %}
+                                </div>
+                                {% endif %}
+                            </div>
+                            <div class="d-grid">
+                                <button type="submit" class="btn btn-primary" {{ "disabled" if total_emails == 0 else "" }}>
+                                    <i class="bi bi-calendar-plus"></i> Queue Job
+                                </button>
+                            </div>
+                        </form>
+                    </div>
+                </div>
+            </div>
+        </div>
+    </div>
+</div>
+{% endblock %}
+'''
+
+# Serve the page templates from memory instead of writing them to templates/ on every start
+app.jinja_loader = DictLoader({
+    'base.html': BASE_HTML,
+    'index.html': INDEX_HTML,
+    'scan.html': SCAN_HTML,
+    'account.html': ACCOUNT_HTML,
+    'template.html': TEMPLATE_HTML,
+    'attachments.html': ATTACHMENTS_HTML,
+    'logs.html': LOGS_HTML,
+    'jobs.html': JOBS_HTML
+})
 
-# Create template files on startup
-create_template_files()
+# Seconds from the start of the import to the first request being served
+startup_seconds = None
+
+@app.before_request
+def record_startup_time():
+    """Measures cold start once, on the first request."""
+    global startup_seconds
+    if startup_seconds is None:
+        startup_seconds = time.perf_counter() - STARTUP_STARTED
+        print(f"Cold start to first request: {startup_seconds:.3f}s")
 
 # Flask Routes
 @app.route('/')
 def index():
     """Main dashboard page."""
-    current_user = get_current_user()
-    total_emails = count_emails(EXTRACTED_DATA_FILE)
-    attachment_files = get_attachment_files()
+    current_user = dashboard_cache.get('current_user', CREDENTIALS_FILE, get_current_user)
+    total_emails = dashboard_cache.get('total_emails', recipient_header_path(RECIPIENTS_FILE), count_emails)
+    attachment_files = dashboard_cache.get('attachment_files', FILES_DIRECTORY, get_attachment_files)
     
     return render_template('index.html', 
                          current_user=current_user, 
                          total_emails=total_emails,
-                         attachment_files=attachment_files)
+                         attachment_files=attachment_files,
+                         default_workers=DEFAULT_SEND_WORKERS,
+                         max_workers=MAX_SEND_WORKERS,
+                         max_async_sessions=MAX_ASYNC_SESSIONS,
+                         default_engine=DEFAULT_SEND_ENGINE,
+                         default_batch=SEND_BATCH_SIZE,
+                         max_batch=MAX_SEND_BATCH)
 
 @app.route('/start_sending', methods=['POST'])
 def start_sending():
     """Start the email sending process in a separate thread."""
-    global email_progress
-    
     # Check if already sending
-    if email_progress['status'] == 'sending':
+    if email_progress.running:
         return jsonify({"success": False, "message": "Email sending is already in progress."})
     
     # Check if we have data
-    if count_emails(EXTRACTED_DATA_FILE) == 0:
+    if count_emails(RECIPIENTS_FILE) == 0:
         return jsonify({"success": False, "message": "No email data found. Please scan first."})
     
     # Check if we have credentials
     if not load_credentials():
         return jsonify({"success": False, "message": "No account credentials found. Please add your account first."})
     
+    options = request.get_json(silent=True) or request.form
+    try:
+        workers = int(options.get('workers', DEFAULT_SEND_WORKERS))
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "message": "Workers must be a whole number."})
+    engine = options.get('engine', DEFAULT_SEND_ENGINE)
+    if engine not in SEND_ENGINES:
+        return jsonify({"success": False, "message": f"Engine must be one of: {', '.join(SEND_ENGINES)}."})
+    limit = MAX_ASYNC_SESSIONS if engine == 'asyncio' else MAX_SEND_WORKERS
+    if not 1 <= workers <= limit:
+        return jsonify({"success": False, "message": f"Workers must be between 1 and {limit}."})
+    try:
+        batch = int(options.get('batch', SEND_BATCH_SIZE))
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "message": "Recipients per message must be a whole number."})
+    if not 1 <= batch <= MAX_SEND_BATCH:
+        return jsonify({"success": False, "message": f"Recipients per message must be between 1 and {MAX_SEND_BATCH}."})
+    if batch > 1 and engine == 'spool':
+        return jsonify({"success": False, "message": "The spool engine sends one recipient per message."})
+    
+    # Claim the progress state before the thread starts so a second request or a stale cursor can't slip in
+    if not email_progress.begin():
+        return jsonify({"success": False, "message": "Email sending is already in progress."})
+    
     # Start sending in a separate thread
-    thread = threading.Thread(target=send_emails_thread)
+    profile = str(options.get('profile', '')).lower() in ('1', 'true', 'on', 'yes')
+    thread = threading.Thread(target=send_emails_thread, args=(workers, engine, profile, batch))
     thread.daemon = True
     thread.start()
     
@@ -822,9 +4227,82 @@ def start_sending():
 
 @app.route('/get_progress')
 def get_progress():
-    """Get the current progress of email sending."""
-    global email_progress
-    return jsonify(email_progress)
+    """Get the progress of email sending, with only the results recorded after ?cursor=."""
+    return jsonify(email_progress.snapshot(request.args.get('cursor', 0, type=int)))
+
+@app.route('/progress_stream')
+def progress_stream():
+    """Push progress counters and new results as Server-Sent Events until the campaign ends."""
+    # A reconnecting EventSource resends the original URL, so its Last-Event-ID takes precedence over ?cursor=
+    cursor = request.headers.get('Last-Event-ID', type=int)
+    if cursor is None:
+        cursor = request.args.get('cursor', 0, type=int)
+
+    def events(cursor):
+        version = None
+        while True:
+            if version is not None:
+                email_progress.wait(version, PROGRESS_STREAM_HEARTBEAT)
+            progress = email_progress.snapshot(cursor)
+            if progress['version'] == version:
+                yield ": keep-alive\n\n"
+                continue
+            version = progress['version']
+            cursor = progress['cursor']
+            yield f"id: {cursor}\ndata: {json.dumps(progress)}\n\n"
+            if progress['status'] in ('completed', 'error', 'idle'):
+                return
+            time.sleep(PROGRESS_STREAM_INTERVAL)
+
+    return Response(stream_with_context(events(cursor)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/cache_stats')
+def cache_stats():
+    """Get hit and miss counters of the dashboard cache."""
+    return jsonify(dashboard_cache.stats())
+
+@app.route('/metrics')
+def metrics_page():
+    """Expose stage timings, queue depth, sessions, send rate and cache counters in the Prometheus text format."""
+    progress = email_progress.snapshot()
+    accounts = sender_accounts.stats()
+    lines = metrics.render_histograms()
+
+    def gauge(name, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        for labels, value in samples:
+            lines.append(f"{name}{labels} {value}")
+
+    if startup_seconds is not None:
+        gauge("es_startup_seconds", "Seconds from the start of the import to the first request.",
+              [("", round(startup_seconds, 4))])
+    gauge("es_send_queue_depth", "Recipients waiting in the campaign's send queue.", [("", metrics.queue_depth())])
+    gauge("es_smtp_sessions_active", "Open SMTP sessions.", [("", metrics.active_sessions())])
+    gauge("es_send_rate", "Messages per second sent over the last throughput window.",
+          [("", round(sum(account['per_minute'] for account in accounts) / 60, 3))])
+    gauge("es_send_rate_limit", "Combined rate limit of the usable sender accounts, in messages per second.",
+          [("", progress['rate'])])
+    gauge("es_campaign_running", "1 while a campaign is starting or sending.", [("", int(email_progress.running))])
+    gauge("es_campaign_recipients", "Recipients of the current or last campaign by outcome.",
+          [(f'{{result="{result}"}}', progress[result]) for result in ('total', 'sent', 'failed', 'skipped')])
+    gauge("es_campaign_failures", "Failed recipients of the current or last campaign by error class.",
+          [(f'{{class="{name}"}}', count) for name, count in sorted(progress['failures'].items())])
+    gauge("es_account_daily_remaining", "Messages each sender account may still send today.",
+          [(f'{{account="{account["username"]}"}}', account['daily_remaining']) for account in accounts])
+    cache = dashboard_cache.stats()
+    gauge("es_dashboard_cache_hits", "Dashboard cache hits since start.", [("", cache['hits'])])
+    gauge("es_dashboard_cache_misses", "Dashboard cache misses since start.", [("", cache['misses'])])
+    gauge("es_cache_entries", "Entries held by each in-memory cache.",
+          [('{cache="dashboard"}', cache['entries']), ('{cache="template"}', len(_template_cache)),
+           ('{cache="attachment"}', len(_attachment_cache)), ('{cache="skeleton"}', len(_skeleton_cache))])
+    return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+@app.route('/get_scan_progress')
+def get_scan_progress():
+    """Get the current progress of the Google Sheets scan."""
+    return jsonify(scan_progress)
 
 @app.route('/scan', methods=['GET', 'POST'])
 def scan():
@@ -832,12 +4310,23 @@ def scan():
     if request.method == 'POST':
         floc = request.form.get('file_location')
         gid = request.form.get('sheet_id')
+        incremental = request.form.get('incremental') == 'on'
         
         if not floc or not gid:
             flash('Please provide both file location and sheet ID.', 'error')
             return redirect(url_for('scan'))
         
-        success, message = scan_data(floc, gid)
+        if scan_progress['status'] == 'scanning':
+            flash('A scan is already in progress.', 'error')
+            return redirect(url_for('scan'))
+        
+        # The campaign is reading the recipient store
+        if email_progress.running:
+            flash('Emails are being sent. Scan again once sending has finished.', 'error')
+            return redirect(url_for('scan'))
+        
+        success, message = scan_data(floc, gid, incremental)
+        dashboard_cache.invalidate('total_emails')
         
         if success:
             flash(message, 'success')
@@ -850,42 +4339,54 @@ def scan():
 
 @app.route('/account', methods=['GET', 'POST'])
 def account():
-    """Manage account settings."""
+    """Manage the sender accounts."""
     if request.method == 'POST':
         action = request.form.get('action')
+        username = request.form.get('username')
         
         if action == 'add':
-            username = request.form.get('username')
             password = request.form.get('password')
             
             if not username or not password:
                 flash('Please provide both username and password.', 'error')
                 return redirect(url_for('account'))
+            if ':' in username or ':' in password:
+                flash('Username and password cannot contain ":".', 'error')
+                return redirect(url_for('account'))
+            try:
+                quota = int(request.form.get('quota') or DAILY_SEND_LIMIT)
+                weight = int(request.form.get('weight') or 1)
+            except ValueError:
+                flash('Quota and weight must be whole numbers.', 'error')
+                return redirect(url_for('account'))
             
             try:
-                with open(CREDENTIALS_FILE, "w", encoding='utf-8') as file:
-                    file.write(f"{username}:{password}\n")
+                accounts = [entry for entry in load_accounts() if entry[0] != username]
+                accounts.append((username, password, max(0, quota), max(1, weight)))
+                save_accounts(accounts)
+                dashboard_cache.invalidate('current_user')
                 flash('Credentials saved successfully!', 'success')
             except Exception as e:
                 flash(f'Error saving credentials: {e}', 'error')
                 
         elif action == 'remove':
             try:
-                if os.path.exists(CREDENTIALS_FILE):
-                    os.remove(CREDENTIALS_FILE)
-                    flash('Account removed successfully!', 'success')
-                else:
+                accounts = load_accounts()
+                remaining = [entry for entry in accounts if entry[0] != username]
+                if len(remaining) == len(accounts):
                     flash('No account found to remove.', 'warning')
+                else:
+                    if remaining:
+                        save_accounts(remaining)
+                    else:
+                        os.remove(CREDENTIALS_FILE)
+                    dashboard_cache.invalidate('current_user')
+                    flash('Account removed successfully!', 'success')
             except Exception as e:
                 flash(f'Error removing account: {e}', 'error')
     
-    # Check if account exists
-    credentials = load_credentials()
-    current_account = None
-    if credentials:
-        current_account = credentials[0]  # Just the username
-    
-    return render_template('account.html', current_account=current_account)
+    sender_accounts.load()
+    return render_template('account.html', accounts=sender_accounts.stats(), default_quota=DAILY_SEND_LIMIT)
 
 @app.route('/template', methods=['GET', 'POST'])
 def template():
@@ -896,6 +4397,7 @@ def template():
         try:
             with open(EMAIL_TEMPLATE_FILE, 'w', encoding='utf-8') as f:
                 f.write(content)
+            invalidate_template_cache()
             flash('Template saved successfully!', 'success')
         except Exception as e:
             flash(f'Error saving template: {e}', 'error')
@@ -929,7 +4431,10 @@ def attachments():
         
         if file:
             filename = file.filename
+            os.makedirs(FILES_DIRECTORY, exist_ok=True)
             file.save(os.path.join(FILES_DIRECTORY, filename))
+            invalidate_attachment_cache(os.path.join(FILES_DIRECTORY, filename))
+            dashboard_cache.invalidate('attachment_files')
             flash(f'File "{filename}" uploaded successfully!', 'success')
             return redirect(url_for('attachments'))
     
@@ -943,6 +4448,8 @@ def delete_attachment(filename):
         file_path = os.path.join(FILES_DIRECTORY, filename)
         if os.path.exists(file_path):
             os.remove(file_path)
+            invalidate_attachment_cache(file_path)
+            dashboard_cache.invalidate('attachment_files')
             flash(f'File "{filename}" deleted successfully!', 'success')
         else:
             flash(f'File "{filename}" not found.', 'error')
@@ -953,16 +4460,113 @@ def delete_attachment(filename):
 
 @app.route('/logs')
 def logs():
-    """View email sending logs."""
+    """View email sending logs, newest first, a page at a time."""
+    filters = {key: request.args.get(key, '').strip() for key in ('recipient', 'status', 'since', 'until')}
+    log_writer.flush()
     try:
-        with open("logs.txt", "r", encoding='utf-8') as log_file:
-            logs_content = log_file.read()
-    except:
-        logs_content = "No logs available."
+        entries, has_older, has_newer = query_logs(before=request.args.get('before', type=int),
+                                                   after=request.args.get('after', type=int),
+                                                   **{key: value or None for key, value in filters.items()})
+    except (sqlite3.Error, ValueError) as e:
+        flash(f'Error reading logs: {e}', 'error')
+        entries, has_older, has_newer = [], False, False
+    
+    return render_template('logs.html', entries=entries, filters=filters,
+                           has_older=has_older, has_newer=has_newer)
+
+@app.route('/jobs', methods=['GET', 'POST'])
+def jobs():
+    """List the campaign jobs and queue a new one for the scanned recipients."""
+    job_scheduler.start()
+    if request.method == 'POST':
+        name = request.form.get('name', '').strip() or f"Campaign {datetime.now():%Y-%m-%d %H:%M}"
+        template_content = request.form.get('template_content', '')
+        engine = request.form.get('engine', DEFAULT_JOB_ENGINE)
+        try:
+            priority = int(request.form.get('priority') or 0)
+            workers = int(request.form.get('workers') or DEFAULT_SEND_WORKERS)
+            scheduled = request.form.get('scheduled_at', '').strip()
+            scheduled_at = datetime.fromisoformat(scheduled).strftime('%Y-%m-%d %H:%M:%S') if scheduled else None
+        except ValueError:
+            flash('Priority and workers must be whole numbers and the start a valid date and time.', 'error')
+            return redirect(url_for('jobs'))
+        
+        limit = MAX_ASYNC_SESSIONS if engine == 'asyncio' else MAX_SEND_WORKERS
+        if engine not in JOB_ENGINES:
+            flash(f"Engine must be one of: {', '.join(JOB_ENGINES)}.", 'error')
+        elif not 1 <= workers <= limit:
+            flash(f'Workers must be between 1 and {limit}.', 'error')
+        elif not template_content.strip():
+            flash('The template cannot be empty.', 'error')
+        elif count_emails(RECIPIENTS_FILE) == 0:
+            flash('No email data found. Please scan first.', 'error')
+        else:
+            available = get_attachment_files()
+            attachments = [file for file in request.form.getlist('attachments') if file in available]
+            try:
+                job_queue.enqueue(name, enumerate(iter_recipients(RECIPIENTS_FILE)), template_content, attachments,
+                                  engine, workers, priority, scheduled_at)
+                job_scheduler.wake()
+                flash(f'Job "{name}" queued.', 'success')
+            except Exception as e:
+                flash(f'Error queueing job: {e}', 'error')
+        
+        return redirect(url_for('jobs'))
+    
+    try:
+        job_list = job_queue.jobs()
+    except sqlite3.Error as e:
+        flash(f'Error reading jobs: {e}', 'error')
+        job_list = []
+    try:
+        with open(EMAIL_TEMPLATE_FILE, 'r', encoding='utf-8') as f:
+            template_content = f.read()
+    except OSError:
+        template_content = ""
+    
+    return render_template('jobs.html', jobs=job_list, actions=JOB_ACTIONS,
+                           template_content=template_content,
+                           attachment_files=get_attachment_files(),
+                           total_emails=count_emails(RECIPIENTS_FILE),
+                           engines=JOB_ENGINES,
+                           default_workers=DEFAULT_SEND_WORKERS,
+                           max_async_sessions=MAX_ASYNC_SESSIONS)
+
+@app.route('/jobs/<int:job_id>/<action>', methods=['POST'])
+def job_action(job_id, action):
+    """Pause, resume or cancel a job; a batch already being sent finishes first."""
+    if action not in JOB_ACTIONS:
+        flash(f'Unknown job action "{action}".', 'error')
+        return redirect(url_for('jobs'))
+    
+    status, allowed = JOB_ACTIONS[action]
+    try:
+        if job_queue.set_status(job_id, status, allowed):
+            job_scheduler.wake()
+            flash(f'Job {job_id} {status}.', 'success')
+        else:
+            flash(f'Job {job_id} cannot be {status} from its current state.', 'warning')
+    except sqlite3.Error as e:
+        flash(f'Error updating job: {e}', 'error')
     
-    return render_template('logs.html', logs_content=logs_content)
+    return redirect(url_for('jobs'))
+
+@app.route('/get_jobs')
+def get_jobs():
+    """Get the campaign jobs, newest first."""
+    return jsonify(job_queue.jobs())
 
 if __name__ == '__main__':
+    create_default_template()
+
+    # One-shot migration of the old monolithic JSON store
+    if os.path.exists(EXTRACTED_DATA_FILE) and not os.path.exists(RECIPIENTS_FILE):
+        print(import_extracted_data()[1])
+
+    # The reloader runs this block in a watcher process too; only the process serving requests runs queued jobs
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        job_scheduler.start()
+
     print("Starting Email Sender Web Application...")
     print("Access the application at: http://localhost:5000")
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,115 @@
+"""Local fake of the gspread worksheet API, for exercising the sheet scan without Google Sheets.
+
+Run it to scan a synthetic sheet, optionally with a gap of blank rows, in a scratch directory and check that
+every row with an address reached the recipient store. Example:
+
+    python fake_sheet.py --rows 100000 --grid 300000 --gap-at 1500 --gap 5000
+"""
+import argparse
+import os
+import re
+import shutil
+import sys
+import tempfile
+from array import array
+
+REPO_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+RANGE_PATTERN = re.compile(r"([A-Z]+)(\d+):([A-Z]+)(\d+)")
+
+
+def column_number(letters):
+    number = 0
+    for letter in letters:
+        number = number * 26 + ord(letter) - ord('A') + 1
+    return number
+
+
+class FakeWorksheet:
+    """Serves batch_get and row_count from a list of rows, the way the Sheets API does.
+
+    row_count is the size of the grid, which may run past the last row with data. Like the API, batch_get
+    leaves out trailing blank cells and rows of each range. requests and cells count what was fetched.
+    """
+
+    def __init__(self, rows, row_count=None):
+        self.rows = rows
+        self.row_count = row_count if row_count is not None else len(rows)
+        self.requests = 0
+        self.cells = 0
+
+    def cell(self, row, column):
+        values = self.rows[row - 1] if row <= len(self.rows) else ()
+        return values[column - 1] if column <= len(values) else ""
+
+    def batch_get(self, ranges):
+        self.requests += 1
+        value_ranges = []
+        for cell_range in ranges:
+            first_column, first_row, last_column, last_row = RANGE_PATTERN.fullmatch(cell_range).groups()
+            columns = range(column_number(first_column), column_number(last_column) + 1)
+            value_range = []
+            for row in range(int(first_row), min(int(last_row), self.row_count) + 1):
+                values = [self.cell(row, column) for column in columns]
+                while values and not values[-1]:
+                    values.pop()
+                value_range.append(values)
+            while value_range and not value_range[-1]:
+                value_range.pop()
+            self.cells += sum(len(values) for values in value_range)
+            value_ranges.append(value_range)
+        return value_ranges
+
+
+def build_sheet(rows, grid, gap_at, gap, name_column, email_column):
+    """Returns a FakeWorksheet with a header row and rows addresses, with gap blank rows after the first gap_at."""
+    width = max(name_column, email_column)
+    sheet_rows = [["Header"] * width]
+    for i in range(rows):
+        if i == gap_at:
+            sheet_rows.extend([] for _ in range(gap))
+        values = [""] * width
+        values[name_column - 1] = f"Recipient{i}"
+        values[email_column - 1] = f"user{i}@example.com"
+        sheet_rows.append(values)
+    return FakeWorksheet(sheet_rows, max(grid, len(sheet_rows)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000, help="Rows with an address")
+    parser.add_argument("--grid", type=int, default=0, help="Rows in the sheet's grid, past the data if larger")
+    parser.add_argument("--gap-at", type=int, default=0, help="Address rows before the gap")
+    parser.add_argument("--gap", type=int, default=0, help="Blank rows in the gap")
+    parser.add_argument("--page-size", type=int, help="Rows fetched per request")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="es-sheet-")
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIRECTORY)
+    import es
+
+    try:
+        sheet = build_sheet(args.rows, args.grid, args.gap_at, args.gap, es.NAME_COLUMN, es.EMAIL_COLUMN)
+        hashes = array('I')
+        page_size = args.page_size or es.SCAN_PAGE_SIZE
+        count = es.scan_worksheet(sheet, page_size=page_size, hashes=hashes)
+        print(f"Full scan: {count} entries, {sheet.requests} requests, {sheet.cells} cells fetched")
+
+        sheet.requests = sheet.cells = 0
+        sheet.rows.append([""] * (es.EMAIL_COLUMN - 1) + ["appended@example.com"])
+        sheet.row_count = max(sheet.row_count, len(sheet.rows))
+        summary = es.scan_worksheet_incremental(sheet, hashes, array('I'), page_size=args.page_size or
+                                                es.SCAN_VERIFY_PAGE_SIZE)
+        print(f"Incremental scan: {summary['added']} added, {summary['total']} entries, "
+              f"{sheet.requests} requests, {sheet.cells} cells fetched")
+    finally:
+        os.chdir(REPO_DIRECTORY)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if count != args.rows or summary['added'] != 1 or summary['total'] != args.rows + 1:
+        print("Rows were lost in the scan")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
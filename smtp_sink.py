@@ -0,0 +1,175 @@
+"""Local asyncio SMTP sink that accepts and discards mail, for exercising the send engines without a network."""
+import argparse
+import asyncio
+import random
+import ssl
+import threading
+import time
+
+
+class SMTPSink:
+    """Speaks just enough SMTP for es.py's clients: EHLO, STARTTLS, AUTH, MAIL/RCPT/DATA, RSET, NOOP and QUIT.
+
+    latency delays every DATA reply by that many seconds, throttle_rate answers that fraction of MAIL
+    commands with a 450 rate-limit reply and failure_rate rejects that fraction of RCPT commands with 550.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, certfile=None, keyfile=None, keep_messages=False,
+                 latency=0.0, throttle_rate=0.0, failure_rate=0.0, seed=None):
+        self.host = host
+        self.port = port
+        self.keep_messages = keep_messages
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.throttled = 0
+        self.rejected = 0
+        self.tls_context = None
+        if certfile:
+            self.tls_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+            self.tls_context.load_cert_chain(certfile, keyfile)
+        self.messages = []
+        self.received = 0
+        self.connections = 0
+        self.started = time.monotonic()
+        self._loop = None
+        self._server = None
+
+    def features(self, tls_active):
+        features = ["PIPELINING", "8BITMIME", "AUTH PLAIN LOGIN"]
+        if self.tls_context and not tls_active:
+            features.append("STARTTLS")
+        return features
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        tls_active = False
+        receivers = []
+        writer.write(b"220 smtp-sink ready\r\n")
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.decode("utf-8", "replace").strip()
+                verb = command[:4].upper()
+                if verb in ("EHLO", "HELO"):
+                    features = self.features(tls_active)
+                    writer.write(b"250-smtp-sink\r\n" + b"".join(
+                        f"250{' ' if i == len(features) - 1 else '-'}{feature}\r\n".encode("ascii")
+                        for i, feature in enumerate(features)))
+                elif verb == "STAR" and self.tls_context and not tls_active:
+                    writer.write(b"220 ready to start TLS\r\n")
+                    await writer.drain()
+                    await writer.start_tls(self.tls_context)
+                    tls_active = True
+                    continue
+                elif verb == "AUTH":
+                    parts = command.split()
+                    if len(parts) == 2 and parts[1].upper() == "LOGIN":
+                        for prompt in (b"334 VXNlcm5hbWU6\r\n", b"334 UGFzc3dvcmQ6\r\n"):
+                            writer.write(prompt)
+                            await writer.drain()
+                            await reader.readline()
+                    writer.write(b"235 authenticated\r\n")
+                elif verb == "MAIL":
+                    receivers = []
+                    if self.throttle_rate and self.random.random() < self.throttle_rate:
+                        self.throttled += 1
+                        writer.write(b"450 4.2.1 rate limit exceeded, try again later\r\n")
+                    else:
+                        writer.write(b"250 sender ok\r\n")
+                elif verb == "RCPT":
+                    if self.failure_rate and self.random.random() < self.failure_rate:
+                        self.rejected += 1
+                        writer.write(b"550 5.1.1 no such user\r\n")
+                    else:
+                        receivers.append(command.split(":", 1)[-1].strip(" <>"))
+                        writer.write(b"250 recipient ok\r\n")
+                elif verb == "DATA":
+                    writer.write(b"354 end data with <CR><LF>.<CR><LF>\r\n")
+                    await writer.drain()
+                    chunks = []
+                    while True:
+                        data = await reader.readline()
+                        if not data or data == b".\r\n":
+                            break
+                        if self.keep_messages:
+                            chunks.append(data)
+                    if self.latency:
+                        await asyncio.sleep(self.latency)
+                    self.received += 1
+                    if self.keep_messages:
+                        self.messages.append((receivers, b"".join(chunks)))
+                    writer.write(b"250 queued\r\n")
+                elif verb == "RSET":
+                    receivers = []
+                    writer.write(b"250 reset\r\n")
+                elif verb == "QUIT":
+                    writer.write(b"221 bye\r\n")
+                    await writer.drain()
+                    break
+                else:
+                    writer.write(b"250 ok\r\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, ssl.SSLError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self):
+        self._server = await asyncio.start_server(self.handle, self.host, self.port, limit=1 << 20)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self._server
+
+    def start(self):
+        """Runs the sink on its own event loop in a daemon thread and returns once it is listening."""
+        ready = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self.serve())
+            ready.set()
+            self._loop.run_forever()
+
+        threading.Thread(target=run, daemon=True).start()
+        ready.wait()
+        return self
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._server.close)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=2525)
+    parser.add_argument("--certfile", help="Certificate for STARTTLS; STARTTLS is not offered without one")
+    parser.add_argument("--keyfile")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to wait before acknowledging DATA")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of MAIL commands answered with 450")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of RCPT commands answered with 550")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    sink = SMTPSink(args.host, args.port, args.certfile, args.keyfile, latency=args.latency,
+                    throttle_rate=args.throttle_rate, failure_rate=args.failure_rate, seed=args.seed)
+
+    async def run():
+        server = await sink.serve()
+        print(f"SMTP sink listening on {sink.host}:{sink.port}")
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        print(f"Received {sink.received} messages over {sink.connections} connections "
+              f"({sink.throttled} throttled, {sink.rejected} rejected)")
+
+
+if __name__ == "__main__":
+    main()